@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   bench_import.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+
+The import time of pk4adi, each case run in a fresh interpreter.
+
+"import pk4adi", "from pk4adi import compare_pks" and the numpy-only path of calculate_pk()
+should not load pandas, scipy or tabulate, the script exits with 1 if they do.
+
+    python benchmarks/bench_import.py
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ["pandas", "scipy", "tabulate"]
+
+CASES = [
+    ("numpy", "import numpy", False),
+    ("import pk4adi", "import pk4adi", True),
+    ("calculate_pk, numpy only",
+     "import numpy as np\nfrom pk4adi import calculate_pk\n"
+     "calculate_pk(np.array([0, 0, 1, 2, 1, 3]), np.array([1, 1, 2, 2, 3, 3]), auto_print=False)", True),
+    ("from pk4adi import compare_pks", "from pk4adi import compare_pks", True),
+    ("calculate_pk, printed",
+     "import numpy as np\nfrom pk4adi import calculate_pk\n"
+     "calculate_pk(np.array([0, 0, 1, 2, 1, 3]), np.array([1, 1, 2, 2, 3, 3]))", False),
+    ("from pk4adi import *", "from pk4adi import *", False),
+]
+
+SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+exec(compile(%r, "<case>", "exec"))
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def run_case(code, repeat = 5):
+    """
+    The best time of code among repeat fresh interpreters and the heavy modules it loaded.
+    """
+
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", SNIPPET % (code, HEAVY)], cwd=ROOT,
+                             env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def main():
+    failed = False
+    print("%-32s %10s  %s" % ("case", "seconds", "heavy modules loaded"))
+    for name, code, light in CASES:
+        result = run_case(code)
+        print("%-32s %10.4f  %s" % (name, result["seconds"], ", ".join(result["loaded"]) or "-"))
+        if light and result["loaded"]:
+            failed = True
+    if failed:
+        print("pandas, scipy or tabulate should not be loaded by the light cases.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
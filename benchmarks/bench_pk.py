@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   bench_pk.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+
+Benchmarks of the hot paths of pk4adi on synthetic data.
+
+Each case records the best wall time of a few repeats and the peak memory traced by tracemalloc,
+and the engines are checked against the reference implementation wherever it is affordable.
+
+    python benchmarks/bench_pk.py                     # the quick grid
+    python benchmarks/bench_pk.py --full              # n_case up to 1e7
+    python benchmarks/bench_pk.py --sizes 1e3 1e5 --out results.csv
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+import itertools
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pk4adi.pk import calculate_pk, print_pk, calculate_pk_from_table, _exact_sum, _cell_e
+from pk4adi.pkc import compare_pks, compare_pks_matrix, T2P
+from pk4adi.utils import print_table
+
+QUICK_SIZES = [1e2, 1e3, 1e4, 1e5]
+FULL_SIZES = [1e2, 1e3, 1e4, 1e5, 1e6, 1e7]
+KEYS = ["PK", "SE0", "SE1"]
+JACK_KEYS = ["PKj", "SEj"]
+
+
+def make_cases(n_case, x_levels = 100, y_levels = 5, ties = 0.5, jackknife = True, seed = 0):
+    """
+    Synthetic indicator and state of n_case cases.
+
+    Parameters
+    ----------
+    n_case : int.
+        The case num.
+    x_levels : int or None.
+        The distinct value num of the tied part of the indicator, None for a continuous indicator.
+    y_levels : int.
+        The distinct value num of the state.
+    ties : float, in [0, 1].
+        The proportion of the cases whose indicator is rounded to x_levels values,
+        the others stay continuous and (almost surely) distinct.
+    jackknife : bool.
+        Whether jackknife could be done or not. If False, y only holds two states
+        and one of them is held by a single case.
+    seed : int.
+        The seed of the random generator.
+
+    Returns
+    -------
+    x, y : numpy.ndarray.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    if jackknife:
+        y = rng.integers(0, y_levels, n_case)
+    else:
+        y = np.zeros(n_case, dtype=int)
+        y[rng.integers(n_case)] = 1
+
+    # the indicator follows the state with some noise.
+    x = y + rng.normal(scale=y_levels / 2, size=n_case)
+    if x_levels is not None:
+        tied = rng.random(n_case) < ties
+        low, high = x.min(), x.max()
+        x[tied] = np.round((x[tied] - low) / (high - low) * (x_levels - 1))
+    return x, y
+
+
+def measure(func, repeat = 3):
+    """
+    The best wall time of func() among repeat runs and the peak memory of the first run.
+
+    Returns
+    -------
+    seconds, peak_mb, result.
+
+    """
+
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best, peak / 2**20, result
+
+
+def agreement(ans, ref, keys):
+    """
+    The max relative difference of the keys between two results.
+    """
+
+    diff = 0.0
+    for key in keys:
+        a, b = float(ans[key]), float(ref[key])
+        if np.isnan(a) and np.isnan(b):
+            continue
+        diff = max(diff, abs(a - b) / max(abs(b), 1e-300))
+    return diff
+
+
+def bench_calculate_pk(sizes, methods, reference_limit, repeat):
+    records = []
+    grid = itertools.product(sizes, [10, 1000, None], [2, 5], [0.0, 0.5, 1.0], [True, False])
+    for n_case, x_levels, y_levels, ties, jackknife in grid:
+        # a continuous indicator has no ties, and y_levels does not matter without jackknife.
+        if (x_levels is None) != (ties == 0) or (not jackknife and y_levels != 2):
+            continue
+        x, y = make_cases(n_case, x_levels, y_levels, ties, jackknife)
+        ref = None
+        if n_case <= reference_limit:
+            seconds, peak, ref = measure(lambda: calculate_pk(x, y, False, method="reference"), 1)
+            records.append(_record("calculate_pk", "reference", n_case, x, y, ties, jackknife, seconds, peak, 0.0, 0.0))
+        for method in methods:
+            # the dense matrix of a continuous indicator would not fit for the largest sizes.
+            if method == "numpy" and x_levels is None and n_case > 1e5:
+                continue
+            func = lambda: calculate_pk(x, y, False, method=method, keep_matrices=False)
+            seconds, peak, ans = measure(func, repeat)
+            diff = agreement(ans, ref, KEYS) if ref is not None else np.nan
+            jack_diff = agreement(ans, ref, JACK_KEYS) if ref is not None else np.nan
+            records.append(_record("calculate_pk", method, n_case, x, y, ties, jackknife, seconds, peak, diff, jack_diff))
+    return records
+
+
+def bench_compare(sizes, repeat):
+    records = []
+    for n_case in sizes:
+        if n_case > 1e6:
+            continue
+        x, y = make_cases(n_case)
+        rng = np.random.default_rng(1)
+        pks = [calculate_pk(x + rng.normal(size=n_case), y, False, keep_matrices=False) for _ in range(8)]
+        seconds, peak, _ = measure(lambda: compare_pks(pks[0], pks[1], False), repeat)
+        records.append(_record("compare_pks", "", n_case, x, y, 0.5, True, seconds, peak))
+        seconds, peak, _ = measure(lambda: compare_pks_matrix(pks, auto_print=False), repeat)
+        records.append(_record("compare_pks_matrix(8)", "", n_case, x, y, 0.5, True, seconds, peak))
+
+    # T2P, the exact t.sf() and the dichotomy of the previous versions.
+    targets = np.linspace(0.1, 4, 200)
+    for legacy in [False, True]:
+        seconds, peak, _ = measure(lambda: [T2P(t, 99, legacy=legacy) for t in targets], repeat)
+        records.append({"function": "T2P x 200", "method": "legacy" if legacy else "t.sf", "seconds": seconds, "peak_mb": peak})
+    seconds, peak, _ = measure(lambda: T2P(targets, 99), repeat)
+    records.append({"function": "T2P(array of 200)", "method": "t.sf", "seconds": seconds, "peak_mb": peak})
+    return records
+
+
+def bench_print(repeat):
+    x, y = make_cases(1000)
+    ans = calculate_pk(x, y, False)
+    with open(os.devnull, "w") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            seconds, peak, _ = measure(lambda: print_pk(ans), repeat)
+        finally:
+            sys.stdout = stdout
+    return [{"function": "print_pk", "method": "", "seconds": seconds, "peak_mb": peak}]
+
+
+def bench_large_n(sizes, repeat):
+    """
+    The cost of the overflow-safe sums. The sum of A * C * C is timed in plain int64 (which overflows)
+    and by _exact_sum() on cells large enough to take the split words, _exact_sum() is checked on
+    adversarial inputs by check_exact_sum(), then calculate_pk() is checked
+    against Python ints on the largest size whose sums are out of the range of int64.
+    """
+
+    records = []
+    rng = np.random.default_rng(2)
+    for cells in sizes:
+        a = rng.integers(1, 1000, int(cells))
+        c = rng.integers(0, 2**30, int(cells))
+        seconds, peak, _ = measure(lambda: (a * c * c).sum(), repeat)
+        records.append({"function": "sum of A * C * C", "method": "int64", "n_case": int(cells), "seconds": seconds, "peak_mb": peak})
+        seconds, peak, _ = measure(lambda: _exact_sum(a, c, c), repeat)
+        records.append({"function": "sum of A * C * C", "method": "exact", "n_case": int(cells), "seconds": seconds, "peak_mb": peak})
+    records.append(check_exact_sum(rng))
+
+    # a binary state and 4 indicator levels, Term1 exceeds 2**63 from about 5e6 cases on.
+    n_case = max(sizes)
+    if n_case < 5e6:
+        return records
+    y = rng.integers(0, 2, int(n_case))
+    x = np.round(y + rng.normal(scale=2, size=int(n_case))).clip(-1, 2)
+    A = pd.crosstab(y, x).to_numpy().astype(object)
+    E = _cell_e(A)
+    ni = A.sum(axis=1)
+    Term1 = int((A * E * E).sum())
+    Qcdt = int((A * (n_case - ni[:, None] - A.sum(axis=0)[None, :] + A)).sum()) + int((A * (A.sum(axis=0)[None, :] - A)).sum())
+    QcQd = int((A * E).sum())
+    ref = {"SE0": math.sqrt((Term1 * n_case - QcQd * QcQd) / n_case) / Qcdt}
+    for method in ["numpy", "sparse"]:
+        seconds, peak, ans = measure(lambda: calculate_pk(x, y, False, method=method, keep_matrices=False), repeat)
+        records.append(_record("calculate_pk (Term1 > 2**63)", method, n_case, x, y, 1.0, True, seconds, peak, agreement(ans, ref, ["SE0"])))
+    seconds, peak, ans = measure(lambda: calculate_pk_from_table(A.astype(int), auto_print=False), repeat)
+    records.append(_record("calculate_pk_from_table (Term1 > 2**63)", "numpy", n_case, x, y, 1.0, True, seconds, peak, agreement(ans, ref, ["SE0"])))
+    return records
+
+
+def check_exact_sum(rng, trials = 200):
+    """
+    _exact_sum() against Python ints on adversarial a, u and v, up to a < 2**31, |u| < 2**40 and |v| < 2**33,
+    whose sums leave int64 after a few tens of elements. The relative difference is 0 only if all are exact.
+    """
+
+    diff = 0.0
+    for _ in range(trials):
+        n = int(rng.integers(1, 200))
+        a = rng.integers(0, int(rng.choice([2, 2**20, 2**31])), n)
+        u = rng.integers(-2**40, 2**40, n) >> int(rng.integers(0, 31))
+        v = rng.integers(-2**33, 2**33, n) >> int(rng.integers(0, 24))
+        exact = sum(int(ai) * int(ui) * int(vi) for ai, ui, vi in zip(a, u, v))
+        for total in [_exact_sum(a, u, v), int(_exact_sum(a[None, :], u[None, :], v[None, :], axis=1)[0])]:
+            diff = max(diff, float(abs(total - exact)) / max(abs(exact), 1))
+    return {"function": "_exact_sum (adversarial)", "method": "numpy", "n_case": trials, "seconds": np.nan,
+            "peak_mb": np.nan, "max_rel_diff": diff}
+
+
+def _record(function, method, n_case, x, y, ties, jackknife, seconds, peak, diff = np.nan, jack_diff = np.nan):
+    return {"function": function, "method": method, "n_case": int(n_case),
+            "x_levels": len(np.unique(x)), "y_levels": len(np.unique(y)), "ties": ties, "jackknife": jackknife,
+            "seconds": seconds, "peak_mb": peak, "max_rel_diff": diff, "jack_rel_diff": jack_diff}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmarks of pk4adi.")
+    parser.add_argument("--full", action="store_true", help="n_case from 1e2 to 1e7.")
+    parser.add_argument("--sizes", nargs="+", type=float, help="the n_case values to run.")
+    parser.add_argument("--methods", nargs="+", default=["numpy", "sparse"], help="the engines compared with the reference.")
+    parser.add_argument("--reference-limit", type=float, default=2000, help="the max n_case to run the reference engine.")
+    parser.add_argument("--repeat", type=int, default=3, help="the runs timed for each case.")
+    parser.add_argument("--out", help="save the records to a .csv or .json file.")
+    args = parser.parse_args(argv)
+
+    sizes = [int(n) for n in (args.sizes or (FULL_SIZES if args.full else QUICK_SIZES))]
+    records = bench_calculate_pk(sizes, args.methods, args.reference_limit, args.repeat)
+    records += bench_compare(sizes, args.repeat)
+    records += bench_print(args.repeat)
+    records += bench_large_n(sizes, args.repeat)
+    table = pd.DataFrame(records)
+
+    shown = table.copy()
+    for name in ["n_case", "x_levels", "y_levels"]:
+        shown[name] = shown[name].map(lambda v: "" if pd.isna(v) else str(int(v)))
+    print_table(shown.fillna(""), floatfmt=".4g")
+    if args.out is not None:
+        if args.out.endswith(".json"):
+            table.to_json(args.out, orient="records", indent=1)
+        else:
+            table.to_csv(args.out, index=False)
+
+    # the engines should agree with the reference up to the rounding errors. The jackknife of the
+    # reference subtracts SPKm * SPKm / n_case from SSPKm, so its SEj is only accurate to about 1e-8.
+    worst = table["max_rel_diff"].max()
+    jack_worst = table["jack_rel_diff"].max()
+    if worst > 1e-9 or jack_worst > 1e-6:
+        print("The engines disagree with the reference, max relative difference %.3g (PKj, SEj: %.3g)." % (worst, jack_worst))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
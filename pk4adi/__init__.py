@@ -6,8 +6,41 @@
 @License :   (C)Copyright 2004-2020, Zhejiang University
 """
 
-from .pk import *
-from .pkc import *
-from .utils import *
+import importlib
 
 __version__ = '0.1.4'
+
+# the public names of each module, which is only imported on the first access of one of them,
+# so "import pk4adi" does not load pandas, scipy or tabulate.
+_MODULES = {
+    "pk": ["calculate_pk", "calculate_pk_from_table", "print_pk", "PKResult"],
+    "pkc": ["compare_pks", "print_pks", "compare_pks_matrix", "print_pks_matrix"],
+    "utils": ["print_table"],
+    "batch": ["calculate_pk_batch", "pk_groupby"],
+    "parallel": ["calculate_pks_parallel", "compare_pks_parallel"],
+    "stream": ["IncrementalPK", "rolling_pk"],
+    "resample": ["bootstrap_pk", "print_bootstrap_pk", "permutation_compare_pks", "print_permutation_compare_pks"],
+    "chunked": ["calculate_pk_chunked", "calculate_pk_from_file"],
+    "cache": ["PKCache", "fingerprint"],
+    "profiling": ["PKProfiler"],
+    "pooled": ["PKStats"],
+    "export": ["PKWriter", "read_pkm"],
+    "service": ["calculate_pk_async", "compare_pks_async", "PKBatcher"],
+}
+_NAMES = {name: module for module, names in _MODULES.items() for name in names}
+
+__all__ = list(_NAMES)
+
+
+def __getattr__(name):
+    if name in _NAMES:
+        value = getattr(importlib.import_module("." + _NAMES[name], __name__), name)
+        globals()[name] = value
+        return value
+    if name in _MODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_MODULES))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   batch.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import numpy as np
+import pandas as pd
+from pk4adi.utils import print_table
+from pk4adi.pk import _check_array, _factorize_y, _numpy_tables, _sparse_tables, _pk_ans, _stats_of_tables
+from pk4adi.parallel import _run
+
+__all__ = ["calculate_pk_batch", "pk_groupby"]
+
+_BATCH_ENGINES = {"numpy": _numpy_tables, "sparse": _sparse_tables}
+_GROUP_STATS = ["n_case", "PK", "SE0", "SE1", "jack_ok", "PKj", "SEj"]
+_CHUNK_ITEMS = 2**22
+
+
+def calculate_pk_batch(X, y_in, auto_print = True, method = "numpy", keep_ans = False, keep_matrices = False, validate = True):
+    """
+    Compute the pk values of many indicators assessed against the same state.
+        The state y is checked and categorized only once and shared by all the indicators.
+
+    Parameters
+    ----------
+    X : a pandas.DataFrame or a 2-D numpy.ndarray.
+        Indicators, one indicator per column and one case per row.
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        State.
+    auto_print : bool.
+        Whether to print the table before returning it or not.
+    method : string, default value is "numpy".
+        The engine used for each indicator, "numpy" or "sparse" (see calculate_pk()).
+    keep_ans : bool, default value is False.
+        Whether to return the ans dict of every indicator too.
+    keep_matrices : bool, default value is False.
+        Whether to save the rows * cols matrix in the kept ans dicts or not.
+    validate : bool, default value is True.
+        Whether to check that X and y only contain numbers without nan or not.
+
+    Returns
+    -------
+    table : a pandas.DataFrame.
+        One row per indicator, indexed by the column names of X (or 0, 1, ... for an array),
+        with the columns PK, SE0, SE1, jack_ok, PKj and SEj.
+    answers : a dict.
+        Only returned if keep_ans is True. The ans dict of every indicator, keyed by its name,
+        which is the same as the return value of calculate_pk().
+
+    Notes
+    -----
+    To be added.
+
+    """
+
+    # check the input type of X and y.
+    assert isinstance(X, pd.DataFrame) or (isinstance(X, np.ndarray) and X.ndim == 2), "X should be a pandas.DataFrame or a 2-D numpy.ndarray."
+    assert method in _BATCH_ENGINES, "method should be one of %s." % ", ".join(_BATCH_ENGINES)
+
+    if isinstance(X, pd.DataFrame):
+        names = list(X.columns)
+        columns = [X[name] for name in names]
+    else:
+        names = list(range(X.shape[1]))
+        columns = [X[:, k] for k in names]
+
+    y = _check_array(y_in, "y", validate)
+    index = y_in.index if isinstance(y_in, pd.Series) else pd.RangeIndex(len(y))
+    assert len(y) >= 2, "x and y should contain at least two cases."
+
+    # check y and set the category once.
+    fy = _factorize_y(y)
+
+    records = []
+    answers = {}
+    for name, x in zip(names, columns):
+        x = _check_array(x, "x %s" % name, validate)
+        assert len(x) == len(y), "x %s and y should contain the same cases." % name
+
+        ans = _pk_ans(_BATCH_ENGINES[method](fy, x), index, method, keep_matrices)
+        records.append([ans["PK"], ans["SE0"], ans["SE1"], ans["jack_ok"], ans["PKj"], ans["SEj"]])
+        if keep_ans:
+            answers[name] = ans
+
+    table = pd.DataFrame(records, index=pd.Index(names, name="indicator"),
+                         columns=["PK", "SE0", "SE1", "jack_ok", "PKj", "SEj"])
+
+    # format and print.
+    if auto_print:
+        print('====================\nPK batch calculation\n====================\n')
+        print_table(table.reset_index().astype({"indicator": str}))
+
+    if keep_ans:
+        return table, answers
+    return table
+
+
+def pk_groupby(df, by, x_cols, y_col, max_workers = 1, auto_print = True, validate = True):
+    """
+    Compute the pk values of the indicators within each group of cases, such as each patient.
+        The groups and the categories within each group are set in one pass over all the cases,
+        then the groups are computed together as stacks of count matrix.
+
+    Parameters
+    ----------
+    df : a pandas.DataFrame.
+        One case per row.
+    by : a string or a list of strings.
+        The columns defining the groups, as pandas.DataFrame.groupby() does.
+    x_cols : a string or a list of strings.
+        The indicator columns.
+    y_col : a string.
+        The state column.
+    max_workers : int or None, default value is 1.
+        The process num used to compute the stacks, 1 to compute them in this process.
+    auto_print : bool.
+        Whether to print the table before returning it or not.
+    validate : bool, default value is True.
+        Whether to check that the indicators and the state only contain numbers without nan or not.
+
+    Returns
+    -------
+    table : a pandas.DataFrame.
+        One row per group, indexed by the values of by, with the columns n_case, PK, SE0, SE1,
+        jack_ok, PKj and SEj. If x_cols is a list, one row per group and indicator, with the
+        last level "indicator" added to the index.
+        PK, SE0 and SE1 are nan for the groups holding less than two states.
+
+    Notes
+    -----
+    The groups are sorted by their col num and packed into stacks of at most about 2**22 cells,
+    so the padding stays small and each stack is computed by _stats_of_tables() at once.
+
+    """
+
+    # check the input type of df and the columns.
+    assert isinstance(df, pd.DataFrame), "df should be a pandas.DataFrame."
+    names = [x_cols] if isinstance(x_cols, str) else list(x_cols)
+    assert len(names) >= 1, "x_cols should contain at least one column."
+
+    # set the group of each case, the cases with a nan key are dropped as groupby() does.
+    grouped = df.groupby(by, sort=True)
+    labels = grouped.size().index
+    g = grouped.ngroup().to_numpy(dtype=float)
+    keep = ~np.isnan(g)
+    g = g[keep].astype(np.int64)
+    n_groups = len(labels)
+
+    # set the category of y within each group once.
+    y = _check_array(df[y_col], "y", validate)[keep]
+    Ry, rows = _group_codes(g, y, n_groups)
+
+    stats = {name: np.zeros((n_groups, len(names)), dtype=bool if name == "jack_ok" else float) for name in _GROUP_STATS}
+    for k, name in enumerate(names):
+        x = _check_array(df[name], "x %s" % name, validate)[keep]
+        Cx, cols = _group_codes(g, x, n_groups)
+
+        # pack the groups with close col nums into the stacks.
+        order = np.argsort(cols, kind="stable")
+        position = np.empty(n_groups, dtype=np.int64)
+        position[order] = np.arange(n_groups)
+        cases = np.argsort(position[g], kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(g, minlength=n_groups)[order])])
+
+        tasks = []
+        start = 0
+        while start < n_groups:
+            stop = start + 1
+            shape = (rows[order[start]], cols[order[start]])
+            while stop < n_groups:
+                size = (max(shape[0], rows[order[stop]]), max(shape[1], cols[order[stop]]))
+                if (stop - start + 1) * size[0] * size[1] > _CHUNK_ITEMS:
+                    break
+                shape = size
+                stop += 1
+            seg = cases[bounds[start]:bounds[stop]]
+            local = position[g[seg]] - start
+            tasks.append((local, Ry[seg], Cx[seg], (stop - start, ) + shape))
+            start = stop
+
+        if max_workers == 1:
+            results = [_group_chunk(*task)[0] for task in tasks]
+        else:
+            results = _run(_group_chunk, tasks, max_workers)
+        for name_stat in _GROUP_STATS:
+            stats[name_stat][order, k] = np.concatenate([r[name_stat] for r in results])
+
+    # construct the table, one row per group (and indicator).
+    if isinstance(x_cols, str):
+        index = labels
+    else:
+        levels = [labels.get_level_values(i).repeat(len(names)) for i in range(labels.nlevels)]
+        levels.append(np.tile(np.array(names, dtype=object), n_groups))
+        index = pd.MultiIndex.from_arrays(levels, names=list(labels.names) + ["indicator"])
+    table = pd.DataFrame({name: stats[name].reshape(-1) for name in _GROUP_STATS}, index=index)
+    table["n_case"] = table["n_case"].astype(int)
+
+    # format and print.
+    if auto_print:
+        print('======================\nPK groupby calculation\n======================\n')
+        print_table(table.reset_index().astype({level: str for level in table.index.names if level is not None}))
+
+    return table
+
+
+def _group_codes(g, v, n_groups):
+    """
+    Set the category of v within each group.
+
+    Parameters
+    ----------
+    g : numpy.ndarray.
+        The group of each case, from 0 to n_groups - 1, each group holding at least one case.
+    v : numpy.ndarray.
+        The values to categorize.
+    n_groups : int.
+        The group num.
+
+    Returns
+    -------
+    codes : numpy.ndarray.
+        The category of each case within its group.
+    levels : numpy.ndarray.
+        The category num of each group.
+
+    """
+
+    order = np.lexsort((v, g))
+    gs = g[order]
+    vs = v[order]
+    new = np.ones(len(gs), dtype=bool)
+    new[1:] = (gs[1:] != gs[:-1]) | (vs[1:] != vs[:-1])
+    rank = np.cumsum(new) - 1
+    base = rank[np.searchsorted(gs, np.arange(n_groups))]
+    codes = np.empty(len(gs), dtype=np.int64)
+    codes[order] = rank - base[gs]
+    levels = np.diff(np.concatenate([base, [rank[-1] + 1]])) if len(gs) else np.zeros(0, dtype=np.int64)
+    return codes, levels
+
+
+def _group_chunk(local, Ry, Cx, shape):
+    """
+    Build the stack of count matrix of some groups and compute their stats.
+    """
+
+    count, rows, cols = shape
+    A = np.bincount((local * rows + Ry) * cols + Cx, minlength=count * rows * cols).reshape(shape).astype(int)
+    return [_stats_of_tables(A)]
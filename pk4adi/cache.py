@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   cache.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from pk4adi.pk import calculate_pk as _calculate_pk, print_pk, _check_array
+from pk4adi.pkc import compare_pks as _compare_pks, print_pks
+
+__all__ = ["PKCache", "fingerprint"]
+
+
+def fingerprint(*values):
+    """
+    A content hash of arrays and parameters, used as the key of PKCache.
+
+    Parameters
+    ----------
+    values : numpy.ndarray, pandas.Series, pandas.Index or any value with a stable repr().
+        The arrays are hashed by their dtype, shape and bytes, without copying them if they are contiguous.
+
+    Returns
+    -------
+    key : string.
+        The hex digest of blake2b with 16 bytes.
+
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, pd.Index):
+            if isinstance(value, pd.RangeIndex):
+                value = (value.start, value.stop, value.step)
+            else:
+                value = pd.util.hash_pandas_object(value, index=False).to_numpy()
+        if isinstance(value, pd.Series):
+            value = value.to_numpy()
+        if isinstance(value, np.ndarray):
+            if value.dtype == object:
+                value = pd.util.hash_pandas_object(pd.Series(value), index=False).to_numpy()
+            h.update(("%s%s" % (value.dtype.str, value.shape)).encode())
+            h.update(memoryview(np.ascontiguousarray(value)).cast("B"))
+        else:
+            h.update(repr(value).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class PKCache(object):
+    """
+    An opt-in memoization of calculate_pk() and compare_pks(), keyed by the content of the inputs.
+
+    The results are kept in memory with the least recently used ones evicted first, once there
+    are more than max_entries of them or their pickled size exceeds max_bytes. If a directory is
+    given, the results are also pickled there and reloaded when they are not in memory,
+    e.g. by another process or a later session.
+
+    Parameters
+    ----------
+    max_entries : int or None, default value is 128.
+        The max num of results kept in memory, None for no limit.
+    max_bytes : int or None, default value is None.
+        The max total pickled size of the results kept in memory, None for no limit.
+    directory : string or None, default value is None.
+        The directory of the on-disk cache, None to keep the results in memory only.
+        It is not bounded, use invalidate() or clear() to remove the files.
+
+    Examples
+    --------
+    cache = PKCache(max_entries=1000, directory=".pk_cache")
+    pk1 = cache.calculate_pk(x1, y, auto_print=False)
+    pk2 = cache.calculate_pk(x2, y, auto_print=False)
+    cache.compare_pks(pk1, pk2)
+    cache.stats()
+
+    """
+
+    def __init__(self, max_entries = 128, max_bytes = None, directory = None):
+        assert max_entries is None or max_entries >= 1, "max_entries should be at least 1."
+        assert max_bytes is None or max_bytes >= 1, "max_bytes should be at least 1."
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def calculate_pk(self, x_in, y_in, auto_print = True, method = "numpy", keep_matrices = True, validate = True):
+        """
+        The same as calculate_pk(), but the result is reused if the same x, y and options were given before.
+        """
+
+        key = self.pk_key(x_in, y_in, method, keep_matrices, validate)
+        ans = self.get(key)
+        if ans is None:
+            ans = _calculate_pk(x_in, y_in, auto_print=False, method=method, keep_matrices=keep_matrices, validate=validate)
+            self.put(key, ans)
+        if auto_print:
+            print_pk(ans)
+        return ans
+
+    def compare_pks(self, pk1, pk2, auto_print = True, legacy = False):
+        """
+        The same as compare_pks(), but the result is reused if the same pk1, pk2 and options were given before.
+            The returned dict is shared with the cache and should not be modified.
+        """
+
+        key = self.pkc_key(pk1, pk2, legacy)
+        ans = self.get(key)
+        if ans is None:
+            ans = _compare_pks(pk1, pk2, auto_print=False, legacy=legacy)
+            self.put(key, ans)
+        if auto_print:
+            print_pks(ans)
+        return ans
+
+    @staticmethod
+    def pk_key(x_in, y_in, method = "numpy", keep_matrices = True, validate = True):
+        """
+        The key of calculate_pk(x_in, y_in, ...), for get() and invalidate().
+        """
+
+        index = x_in.index if isinstance(x_in, pd.Series) else None
+        x = _check_array(x_in, "x", validate)
+        y = _check_array(y_in, "y", validate)
+        return fingerprint("pk", x, y, index, method, keep_matrices)
+
+    @staticmethod
+    def pkc_key(pk1, pk2, legacy = False):
+        """
+        The key of compare_pks(pk1, pk2, ...), for get() and invalidate().
+        """
+
+        values = ["pkc", legacy]
+        for pk in [pk1, pk2]:
+            PKm = pk.get("PKm")
+            values += [pk.get("n_case"), pk.get("PKj"), pk.get("SEj")]
+            values += [PKm, PKm.index] if PKm is not None else [None]
+        return fingerprint(*values)
+
+    def get(self, key):
+        """
+        The cached result of key, None if there is not.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key][0]
+
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                ans = pickle.loads(data)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                ans = None
+            if ans is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._insert(key, ans, len(data))
+                return ans
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key, ans):
+        """
+        Keep ans as the result of key, in memory and in the directory if given.
+        """
+
+        size = 0
+        path = self._path(key)
+        if path is not None or self.max_bytes is not None:
+            data = pickle.dumps(ans, protocol=pickle.HIGHEST_PROTOCOL)
+            size = len(data)
+            if path is not None:
+                temp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+                with open(temp, "wb") as f:
+                    f.write(data)
+                os.replace(temp, path)
+        with self._lock:
+            self._insert(key, ans, size)
+
+    def invalidate(self, key = None):
+        """
+        Remove the result of key from the memory and the directory, or all of them if key is None.
+        """
+
+        with self._lock:
+            keys = list(self._entries) if key is None else [key]
+            for k in keys:
+                if k in self._entries:
+                    self._bytes -= self._entries.pop(k)[1]
+        if self.directory is not None:
+            if key is None:
+                names = [name for name in os.listdir(self.directory) if name.endswith(".pkl")]
+            else:
+                names = [key + ".pkl"]
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        """
+        Remove all the results and reset the statistics.
+        """
+
+        self.invalidate()
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        """
+        The hit and miss statistics.
+
+        Returns
+        -------
+        stats : a dict.
+            hits (in memory), disk_hits, misses, evictions, the num of entries in memory,
+            their pickled size in bytes (0 if neither max_bytes nor directory is given)
+            and hit_rate, the ratio of hits and disk_hits to all the lookups.
+
+        """
+
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else np.nan
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self._path(key) is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl") if self.directory is not None else None
+
+    def _insert(self, key, ans, size):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (ans, size)
+        self._bytes += size
+        while len(self._entries) > 1 and ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                                          or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            self._bytes -= self._entries.popitem(last=False)[1][1]
+            self._stats["evictions"] += 1
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   chunked.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from pk4adi.pk import print_pk, _check_array, _dense_from_cells, _dense_tables, _cell_tables, _pk_ans
+
+__all__ = ["calculate_pk_chunked", "calculate_pk_from_file"]
+
+_CHUNKED_ENGINES = ["numpy", "sparse"]
+
+
+def calculate_pk_chunked(chunks, auto_print = True, method = "sparse", keep_matrices = False, validate = True):
+    """
+    Compute the pk value from the cases given chunk by chunk.
+        Only the counts of the distinct (x, y) pairs are kept between the chunks,
+        so the recordings do not need to fit in the memory.
+
+    Parameters
+    ----------
+    chunks : an iterable of (x, y) pairs.
+        The indicator and the state of the cases in each chunk, x and y could be anything
+        accepted by calculate_pk() such as lists, pandas.Series or numpy.ndarray.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+    method : string, default value is "sparse".
+        The engine used once all the chunks are counted, "numpy" or "sparse" (see calculate_pk()).
+        "sparse" keeps the memory O(cells), the distinct (x, y) pair num.
+    keep_matrices : bool, default value is False.
+        Whether to save the rows * cols matrix A, S, C, D and T in the ans or not.
+    validate : bool, default value is True.
+        Whether to check that x and y only contain numbers without nan or not.
+
+    Returns
+    -------
+    ans : a dict.
+        The same dict as the return value of calculate_pk(), but PKm is None since the cases
+        are not kept, PKm_cells gives the PKm value of each distinct (x, y) pair instead
+        (see calculate_pk_from_table()).
+
+    Notes
+    -----
+    The counts are merged with each chunk by a sort of the distinct pairs and the chunk,
+    which takes O((cells + chunk) log(cells + chunk)) time and O(cells + chunk) memory.
+
+    """
+
+    assert method in _CHUNKED_ENGINES, "method should be one of %s." % ", ".join(_CHUNKED_ENGINES)
+
+    counter = _PairCounter()
+    for k, (x_in, y_in) in enumerate(chunks):
+        x = _check_array(x_in, "x of chunk %d" % k, validate)
+        y = _check_array(y_in, "y of chunk %d" % k, validate)
+        assert len(x) == len(y), "x and y of chunk %d should contain the same cases." % k
+        counter.add(x, y)
+
+    ans = _pk_ans(counter.tables(method), None, method, keep_matrices)
+
+    # format and print.
+    if auto_print:
+        print_pk(ans)
+
+    return ans
+
+
+def calculate_pk_from_file(source, x_col = 0, y_col = 1, chunk_size = 1000000, auto_print = True,
+                           method = "sparse", keep_matrices = False, validate = True, dtype = float, n_cols = 2):
+    """
+    Compute the pk value of the cases stored in a file, reading it chunk by chunk.
+
+    Parameters
+    ----------
+    source : a string or a 2-D numpy.ndarray.
+        The path of the file, or an array such as a numpy.memmap with one case per row.
+        ".npy" files are memory mapped, ".csv", ".txt" and ".tsv" files (also compressed, such as ".csv.gz")
+        are read by pandas.read_csv(), ".parquet" files are read by pyarrow, and the other files are
+        memory mapped as raw binary with the given dtype and n_cols.
+    x_col, y_col : int or string, default values are 0 and 1.
+        The position or the name of the indicator and the state columns.
+    chunk_size : int, default value is 1000000.
+        The num of cases read at once.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+    method : string, default value is "sparse".
+        The engine used once all the chunks are counted (see calculate_pk_chunked()).
+    keep_matrices : bool, default value is False.
+        Whether to save the rows * cols matrix A, S, C, D and T in the ans or not.
+    validate : bool, default value is True.
+        Whether to check that x and y only contain numbers without nan or not.
+    dtype : a numpy dtype, default value is float.
+        The dtype of a raw binary file.
+    n_cols : int, default value is 2.
+        The column num of a raw binary file.
+
+    Returns
+    -------
+    ans : a dict.
+        The same dict as the return value of calculate_pk_chunked().
+
+    """
+
+    assert chunk_size >= 1, "chunk_size should be at least 1."
+    return calculate_pk_chunked(_file_chunks(source, x_col, y_col, chunk_size, dtype, n_cols),
+                                auto_print, method, keep_matrices, validate)
+
+
+class _PairCounter(object):
+    """
+    The counts of the distinct (x, y) pairs, sorted by y then by x.
+    """
+
+    def __init__(self):
+        self.xs = None
+        self.ys = None
+        self.counts = None
+
+    def add(self, xs, ys, counts = None):
+        if len(xs) == 0:
+            return
+        if counts is None:
+            counts = np.ones(len(xs), dtype=np.int64)
+        if self.xs is not None:
+            xs = np.concatenate([self.xs, xs])
+            ys = np.concatenate([self.ys, ys])
+            counts = np.concatenate([self.counts, counts])
+
+        order = np.lexsort((xs, ys))
+        xs = xs[order]
+        ys = ys[order]
+        start = np.ones(len(xs), dtype=bool)
+        start[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+        start = np.flatnonzero(start)
+        self.xs = xs[start]
+        self.ys = ys[start]
+        self.counts = np.add.reduceat(counts[order], start)
+
+    def tables(self, method):
+        """
+        Build the tables used by _pk_ans() from the counts, see _dense_tables() and _cell_tables().
+        """
+
+        assert self.xs is not None, "There should be at least two cases."
+        y_values, cell_i = np.unique(self.ys, return_inverse=True)
+        x_values, cell_j = np.unique(self.xs, return_inverse=True)
+        rows = len(y_values)
+        cols = len(x_values)
+        assert rows >= 2 , "The distinct values of y should be at least two."
+
+        m = _cell_tables(rows, cols, cell_i.reshape(-1), cell_j.reshape(-1), self.counts.astype(int))
+        if method == "numpy":
+            m = _dense_tables(_dense_from_cells(m)["A"])
+        ni = m["ni"] if "ni" in m else m["S"][:, cols - 1]
+        m.update({"jack_ok": bool(rows > 2 or ni.min() >= 2), "x_levels": x_values, "y_levels": y_values})
+        return m
+
+
+def _file_chunks(source, x_col, y_col, chunk_size, dtype, n_cols):
+    """
+    Yield the (x, y) pairs of the chunks of a file or an array.
+    """
+
+    if isinstance(source, np.ndarray):
+        yield from _array_chunks(source, x_col, y_col, chunk_size)
+        return
+
+    path = os.fspath(source)
+    name = path.lower()
+    for suffix in [".gz", ".bz2", ".zip", ".xz", ".zst"]:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+
+    if name.endswith(".npy"):
+        yield from _array_chunks(np.load(path, mmap_mode="r"), x_col, y_col, chunk_size)
+
+    elif name.endswith((".csv", ".txt", ".tsv")):
+        sep = "\t" if name.endswith(".tsv") else ","
+        by_name = isinstance(x_col, str) and isinstance(y_col, str)
+        usecols = [x_col, y_col] if by_name else None
+        for chunk in pd.read_csv(path, sep=sep, usecols=usecols, chunksize=chunk_size):
+            if by_name:
+                yield chunk[x_col], chunk[y_col]
+            else:
+                yield _column(chunk, x_col), _column(chunk, y_col)
+
+    elif name.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow is required to read the parquet files.")
+        parquet = pq.ParquetFile(path)
+        names = parquet.schema_arrow.names
+        columns = [c if isinstance(c, str) else names[c] for c in [x_col, y_col]]
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.column(columns[0]).to_numpy(), batch.column(columns[1]).to_numpy()
+
+    else:
+        data = np.memmap(path, dtype=dtype, mode="r")
+        assert len(data) % n_cols == 0, "The size of the file should be a multiple of n_cols."
+        yield from _array_chunks(data.reshape(-1, n_cols), x_col, y_col, chunk_size)
+
+
+def _array_chunks(data, x_col, y_col, chunk_size):
+    """
+    Yield the (x, y) pairs of the row chunks of a 2-D array or a 1-D structured array.
+    """
+
+    if data.dtype.names is not None:
+        names = data.dtype.names
+        x_col = x_col if isinstance(x_col, str) else names[x_col]
+        y_col = y_col if isinstance(y_col, str) else names[y_col]
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            yield np.asarray(chunk[x_col]), np.asarray(chunk[y_col])
+    else:
+        assert data.ndim == 2, "The array should be 2-D with one case per row."
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            yield np.asarray(chunk[:, x_col]), np.asarray(chunk[:, y_col])
+
+
+def _column(chunk, col):
+    return chunk[col] if isinstance(col, str) else chunk.iloc[:, col]
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   cli.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+
+The pk4adi command, computing the pk values of the indicators in many recordings.
+
+    pk4adi "data/*.csv" --y BIS_state --x BIS PSI --compare-out pairs.csv --out pk.csv --jobs 4
+    pk4adi "data/*.npy" --y 0 --x bis=1 psi=2 --out pk.jsonl --checkpoint pk.ckpt --resume
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+__all__ = ["main"]
+
+_CSV = (".csv", ".tsv", ".txt", ".csv.gz", ".csv.bz2", ".csv.zip", ".csv.xz", ".tsv.gz")
+
+
+def main(argv = None):
+    """
+    The entry of the pk4adi command, see "pk4adi --help".
+
+    Parameters
+    ----------
+    argv : a list of strings or None, default value is None.
+        The arguments, None for sys.argv[1:].
+
+    Returns
+    -------
+    code : int.
+        0 if all the files are done, 1 if some of them failed.
+
+    """
+
+    args = _parser().parse_args(argv)
+    files = _files(args.inputs)
+    if not files:
+        print("pk4adi: no file matches %s." % " ".join(args.inputs), file=sys.stderr)
+        return 1
+
+    outputs = {"pk": args.out, "pkc": args.compare_out}
+    done = set()
+    if args.checkpoint is not None and args.resume and os.path.exists(args.checkpoint):
+        done = _resume(args.checkpoint, outputs)
+    elif args.checkpoint is not None:
+        open(args.checkpoint, "w").close()
+    todo = [path for path in files if path not in done]
+    print("pk4adi: %d files, %d done before, %d to run." % (len(files), len(files) - len(todo), len(todo)), file=sys.stderr)
+
+    streams = {kind: _Stream(path, append=bool(done)) for kind, path in outputs.items() if path is not None}
+    task = dict(y_col=_column(args.y), x_cols=_mapping(args.x), compare=args.compare_out is not None,
+                method=args.method, dropna=args.dropna)
+    failed = 0
+    try:
+        for path, tables, error in _results(todo, task, args.jobs):
+            if error is not None:
+                failed += 1
+                print("pk4adi: %s failed, %s" % (path, error), file=sys.stderr)
+                continue
+            for kind, stream in streams.items():
+                stream.write(tables[kind])
+            if args.checkpoint is not None:
+                _checkpoint(args.checkpoint, path, streams)
+            if args.out is None:
+                _show(path, tables["pk"])
+    finally:
+        for stream in streams.values():
+            stream.close()
+    return 1 if failed else 0
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="pk4adi", description="Compute the pk values of the indicators in many recordings, "
+                                     "and optionally compare the indicators of each recording pairwise.")
+    parser.add_argument("inputs", nargs="+", help="the files or the glob patterns of the recordings, "
+                        ".csv, .tsv or .txt (also compressed, such as .csv.gz) and .npy files with one case per row.")
+    parser.add_argument("--y", required=True, help="the state column, a name or a position (from 0).")
+    parser.add_argument("--x", nargs="+", help="the indicator columns, as COLUMN or NAME=COLUMN to rename them. "
+                        "All the other columns by default.")
+    parser.add_argument("--out", help="the .csv or .jsonl file the pk values are streamed to, printed if not given.")
+    parser.add_argument("--compare-out", help="compare the indicators of each file pairwise by compare_pks(), "
+                        "streaming the results to this .csv or .jsonl file.")
+    parser.add_argument("--jobs", type=int, default=1, help="the num of processes, one file per task.")
+    parser.add_argument("--method", default="numpy", choices=["numpy", "sparse"], help="the engine of calculate_pk().")
+    parser.add_argument("--dropna", action="store_true", help="drop the cases with nan in the state or an indicator.")
+    parser.add_argument("--checkpoint", help="the file recording the files done, so that an interrupted run could be resumed.")
+    parser.add_argument("--resume", action="store_true", help="skip the files recorded in the checkpoint and append to the outputs.")
+    return parser
+
+
+def _files(patterns):
+    """
+    The files matched by the patterns, sorted and without duplicates.
+    """
+
+    files = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        files.extend(os.path.abspath(path) for path in matched if os.path.isfile(path))
+    return list(dict.fromkeys(files))
+
+
+def _column(text):
+    return int(text) if text.lstrip("-").isdigit() else text
+
+
+def _mapping(items):
+    """
+    The (name, column) pairs of the --x items, None for all the other columns.
+    """
+
+    if items is None:
+        return None
+    pairs = []
+    for item in items:
+        name, _, column = item.rpartition("=")
+        pairs.append((name or column, _column(column)))
+    return pairs
+
+
+def _results(files, task, jobs):
+    """
+    Yield (path, tables, error) of each file as soon as it is done.
+    """
+
+    if jobs == 1:
+        for path in files:
+            yield _score_file(path, **task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_score_file, path, **task) for path in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _score_file(path, y_col, x_cols, compare, method, dropna):
+    """
+    The pk values of the indicators of a file, and the comparison of each pair of them.
+
+    Returns
+    -------
+    path : string.
+    tables : a dict of pandas.DataFrame or None.
+        "pk" and "pkc" (None if compare is False) with a leading "file" column.
+        "pkc" has an "error" column, the error message of the pairs failed (whose values are nan).
+    error : string or None.
+        The error message if the file failed.
+
+    """
+
+    try:
+        import pandas as pd
+        from pk4adi.batch import calculate_pk_batch
+        from pk4adi.pkc import compare_pks
+        from pk4adi.export import PKWriter
+
+        data = _read(path)
+        names = list(data.columns)
+        y_name = names[y_col] if isinstance(y_col, int) else y_col
+        assert y_name in names, "no state column %s." % y_col
+        if x_cols is None:
+            x_cols = [(str(name), name) for name in names if name != y_name]
+        X = pd.DataFrame({name: data[names[column] if isinstance(column, int) else column] for name, column in x_cols})
+        y = data[y_name]
+        if dropna:
+            keep = y.notna().to_numpy() & X.notna().all(axis=1).to_numpy()
+            X, y = X[keep], y[keep]
+
+        _, answers = calculate_pk_batch(X, y.to_numpy(), auto_print=False, method=method, keep_ans=True)
+        pk = PKWriter("pk", capacity=len(answers))
+        pk.extend(answers)
+        tables = {"pk": _with_file(pk.to_frame().rename(columns={"name": "indicator"}), path), "pkc": None}
+
+        if compare:
+            pkc = PKWriter("pkc", capacity=max(len(answers) * (len(answers) - 1) // 2, 1))
+            pairs = list(itertools.combinations(answers, 2))
+            errors = []
+            for name1, name2 in pairs:
+                # a pair failing (such as SEDJ = 0 for two indicators ranking the cases alike)
+                # gives a row of nan with its error, the other pairs and the pk values are kept.
+                try:
+                    pkc.append(compare_pks(answers[name1], answers[name2], auto_print=False))
+                    errors.append("")
+                except Exception as e:
+                    n_case = answers[name1]["n_case"]
+                    pkc.append({"type": "pkc", "n_case": n_case, "DF": n_case - 1, "ZJ": "", "TJ": ""})
+                    errors.append("%s: %s" % (type(e).__name__, e))
+            table = pkc.to_frame().drop(columns="name")
+            table["error"] = errors
+            table.insert(0, "indicator2", [name2 for _, name2 in pairs])
+            table.insert(0, "indicator1", [name1 for name1, _ in pairs])
+            tables["pkc"] = _with_file(table, path)
+        return path, tables, None
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e)
+
+
+def _read(path):
+    """
+    The cases of a file as a pandas.DataFrame, the columns of a .npy file are named 0, 1, ...
+    """
+
+    import pandas as pd
+
+    name = path.lower()
+    if name.endswith(".npy"):
+        data = np.load(path, mmap_mode="r")
+        if data.dtype.names is not None:
+            return pd.DataFrame({column: data[column] for column in data.dtype.names})
+        assert data.ndim == 2, "%s should hold a 2-D array." % path
+        return pd.DataFrame(np.asarray(data))
+    assert name.endswith(_CSV), "%s is neither a .csv, .tsv, .txt nor a .npy file." % path
+    return pd.read_csv(path, sep="\t" if ".tsv" in name else ",")
+
+
+def _with_file(table, path):
+    table.insert(0, "file", path)
+    return table
+
+
+class _Stream(object):
+    """
+    An output file the tables are appended to, as CSV or JSON Lines by its extension.
+    """
+
+    def __init__(self, path, append = False):
+        self.jsonl = path.lower().endswith((".jsonl", ".json"))
+        self.header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, "ab" if append else "wb")
+
+    def write(self, table):
+        if self.jsonl:
+            text = table.to_json(orient="records", lines=True).rstrip("\n") + "\n"
+        else:
+            text = table.to_csv(header=self.header, index=False)
+            self.header = False
+        self.file.write(text.encode("utf-8"))
+        self.file.flush()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def _checkpoint(path, path_done, streams):
+    """
+    Record a file done and the sizes of the outputs once its rows are written.
+    """
+
+    entry = {"file": path_done, "sizes": {kind: stream.tell() for kind, stream in streams.items()}}
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _resume(path, outputs):
+    """
+    The files recorded in the checkpoint. The outputs are cut back to their sizes at the last entry,
+    dropping the rows of the files interrupted after they were written.
+    """
+
+    done = set()
+    sizes = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            done.add(entry["file"])
+            sizes = entry["sizes"]
+    for kind, output in outputs.items():
+        if output is not None and os.path.exists(output):
+            with open(output, "r+b") as f:
+                f.truncate(sizes.get(kind, 0))
+    return done
+
+
+def _show(path, table):
+    from pk4adi.utils import print_table
+
+    print('==============\n%s\n==============\n' % path)
+    print_table(table.drop(columns="file"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
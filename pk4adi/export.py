@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   export.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import os
+from collections.abc import Mapping
+import numpy as np
+from pk4adi.pk import PKResult
+from pk4adi.utils import print_table
+
+__all__ = ["PKWriter", "read_pkm"]
+
+# the columns kept for the results of calculate_pk() and compare_pks(), and their dtype.
+_COLUMNS = {
+    "pk": [("n_case", np.int64), ("PK", np.float64), ("SE0", np.float64), ("SE1", np.float64),
+           ("jack_ok", np.bool_), ("PKj", np.float64), ("SEj", np.float64)],
+    "pkc": [("n_case", np.int64), ("PKD", np.float64), ("SED", np.float64), ("ZD", np.float64),
+            ("ZP", np.float64), ("ZJ", object), ("PKDJ", np.float64), ("SEDJ", np.float64),
+            ("DF", np.int64), ("TD", np.float64), ("TP", np.float64), ("TJ", object)],
+}
+# the vector kept case by case.
+_VECTORS = {"pk": "PKm", "pkc": "PKmD"}
+_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".npz": "npz", ".parquet": "parquet"}
+
+
+class PKWriter(object):
+    """
+    Collect many results of calculate_pk() or compare_pks() in columnar buffers, and write them at once.
+
+    The scalars of each result are copied into preallocated numpy arrays, one per column, which grow
+    by doubling, so the results themselves need not be kept. The buffers are written in one pass
+    to CSV, JSON Lines, .npz or Parquet (if pyarrow is installed), and the PKm (or PKmD) vectors
+    to an optional binary side file. Printing is only a view of the buffers.
+
+    Parameters
+    ----------
+    kind : string, default value is "pk".
+        "pk" for the results of calculate_pk(), "pkc" for those of compare_pks().
+    capacity : int, default value is 1024.
+        The num of results preallocated.
+    keep_pkm : bool, default value is False.
+        Whether to keep the PKm vector of each result (PKmD for compare_pks()) for write_pkm() or not.
+    pkm_dtype : numpy.dtype, default value is numpy.float64.
+        The dtype the PKm vectors are kept in, such as numpy.float32 to halve the side file.
+
+    Examples
+    --------
+    writer = PKWriter(keep_pkm=True)
+    for name, x in indicators.items():
+        writer.append(calculate_pk(x, y, auto_print=False, keep_matrices=False), name)
+    writer.write("pk.csv")
+    writer.write_pkm("pkm.npz")
+    writer.print()
+
+    """
+
+    def __init__(self, kind = "pk", capacity = 1024, keep_pkm = False, pkm_dtype = np.float64):
+        assert kind in _COLUMNS, "kind should be one of %s." % ", ".join(_COLUMNS)
+        assert capacity >= 1, "capacity should be at least 1."
+        self.kind = kind
+        self.keep_pkm = keep_pkm
+        self.pkm_dtype = np.dtype(pkm_dtype)
+        self._size = 0
+        self._names = np.empty(capacity, dtype=object)
+        self._buffers = {name: np.empty(capacity, dtype=dtype) for name, dtype in _COLUMNS[kind]}
+        self._pkm = np.empty(capacity if keep_pkm else 0, dtype=self.pkm_dtype)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, result, name = None):
+        """
+        Copy the scalars of a result into the buffers.
+
+        Parameters
+        ----------
+        result : a PKResult or a dict.
+            The return value of calculate_pk() (kind "pk") or compare_pks() (kind "pkc").
+        name : any value or None, default value is None.
+            The name of the result, None for its position.
+
+        """
+
+        assert isinstance(result, Mapping) and result.get("type", "unknown") == self.kind, \
+            "result must be the output of the function %s()." % ("calculate_pk" if self.kind == "pk" else "compare_pks")
+
+        k = self._size
+        if k == len(self._names):
+            self._grow(2 * k)
+        self._names[k] = k if name is None else name
+        for column, buffer in self._buffers.items():
+            buffer[k] = result.get(column)
+
+        end = self._offsets[k]
+        if self.keep_pkm:
+            vector = _vector(result, _VECTORS[self.kind])
+            end = end + len(vector)
+            if end > len(self._pkm):
+                self._pkm = _resized(self._pkm, max(end, 2 * len(self._pkm)))
+            self._pkm[self._offsets[k]:end] = vector
+        self._offsets[k + 1] = end
+        self._size = k + 1
+
+    def extend(self, results, names = None):
+        """
+        append() each of the results, named by names if given.
+            results could also be a dict of results keyed by their names, such as the answers of calculate_pk_batch().
+        """
+
+        if isinstance(results, Mapping) and results.get("type") not in _COLUMNS and names is None:
+            names, results = list(results.keys()), list(results.values())
+        results = list(results)
+        names = [None] * len(results) if names is None else list(names)
+        assert len(names) == len(results), "names and results should have the same length."
+        if self._size + len(results) > len(self._names):
+            self._grow(max(self._size + len(results), 2 * len(self._names)))
+        for result, name in zip(results, names):
+            self.append(result, name)
+
+    def columns(self):
+        """
+        The buffers of the results appended so far.
+
+        Returns
+        -------
+        columns : a dict.
+            The name column and the columns of the kind, as numpy.ndarray views of the buffers.
+
+        """
+
+        columns = {"name": self._names[:self._size]}
+        columns.update({name: buffer[:self._size] for name, buffer in self._buffers.items()})
+        return columns
+
+    def to_frame(self):
+        """
+        The buffers as a pandas.DataFrame, one row per result.
+        """
+
+        import pandas as pd
+        return pd.DataFrame(self.columns())
+
+    def write(self, path, format = None):
+        """
+        Write the buffers in one pass.
+
+        Parameters
+        ----------
+        path : string.
+            The path of the file.
+        format : string or None, default value is None.
+            "csv", "jsonl", "npz" or "parquet", None to take it from the extension of path
+            (".csv", ".jsonl" or ".json", ".npz" and ".parquet").
+
+        Returns
+        -------
+        Nothing will be returned.
+
+        """
+
+        if format is None:
+            format = _FORMATS.get(os.path.splitext(path)[1].lower())
+            assert format is not None, "The format of %s is unknown, it should be one of %s." % (path, ", ".join(_FORMATS))
+        assert format in _FORMATS.values(), "format should be one of csv, jsonl, npz and parquet."
+
+        if format == "csv":
+            self.to_frame().to_csv(path, index=False)
+        elif format == "jsonl":
+            self.to_frame().to_json(path, orient="records", lines=True)
+        elif format == "npz":
+            np.savez(path, **{name: column.astype(str) if column.dtype == object else column
+                              for name, column in self.columns().items()})
+        else:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("pyarrow is required to write the parquet files.")
+            pq.write_table(pa.table({name: column.astype(str) if column.dtype == object else column
+                                     for name, column in self.columns().items()}), path)
+
+    def write_pkm(self, path):
+        """
+        Write the kept PKm (or PKmD) vectors to a .npz side file.
+
+        The vectors are stored end to end in "values", the vector of the result k being
+        values[offsets[k]:offsets[k + 1]], with the names of the results in "names".
+        It is read back by read_pkm().
+
+        Parameters
+        ----------
+        path : string.
+            The path of the file.
+
+        Returns
+        -------
+        Nothing will be returned.
+
+        """
+
+        assert self.keep_pkm, "The PKm vectors are only kept with keep_pkm = True."
+        size = self._size
+        np.savez(path, names=self._names[:size].astype(str), offsets=self._offsets[:size + 1],
+                 values=self._pkm[:self._offsets[size]])
+
+    def print(self, floatfmt = ".3f", tablefmt = 'simple'):
+        """
+        Pretty display of the buffers, as print_pk() and print_pks() do for one result.
+        """
+
+        if self.kind == "pk":
+            print('==============\nPK calculation\n==============\n')
+        else:
+            print('==============\nPKs comparison\n==============\n')
+        print_table(self.to_frame().astype({"name": str}), floatfmt, tablefmt)
+
+    def _grow(self, capacity):
+        self._names = _resized(self._names, capacity)
+        self._buffers = {name: _resized(buffer, capacity) for name, buffer in self._buffers.items()}
+        self._offsets = _resized(self._offsets, capacity + 1)
+
+
+def read_pkm(path):
+    """
+    Read the PKm vectors written by PKWriter.write_pkm().
+
+    Parameters
+    ----------
+    path : string.
+        The path of the file.
+
+    Returns
+    -------
+    names : a list.
+        The names of the results, as strings.
+    vectors : a list of numpy.ndarray.
+        The PKm (or PKmD) vector of each result, views of one array.
+
+    """
+
+    with np.load(path) as data:
+        names, offsets, values = data["names"], data["offsets"], data["values"]
+    return list(names), [values[offsets[k]:offsets[k + 1]] for k in range(len(names))]
+
+
+def _vector(result, key):
+    """
+    The vector of a result as a numpy.ndarray, without building the pandas.Series of a PKResult.
+    """
+
+    vector = result.pkm_values() if key == "PKm" and isinstance(result, PKResult) else result.get(key)
+    return np.empty(0) if vector is None else np.asarray(vector)
+
+
+def _resized(buffer, capacity):
+    new = np.empty(capacity, dtype=buffer.dtype)
+    n = min(len(buffer), capacity)
+    new[:n] = buffer[:n]
+    return new
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   parallel.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from pk4adi.pk import calculate_pk, _check_xy
+from pk4adi.pkc import compare_pks
+
+__all__ = ["calculate_pks_parallel", "compare_pks_parallel"]
+
+
+def calculate_pks_parallel(xs, ys, max_workers = None, chunk_size = 16, method = "numpy", keep_matrices = False):
+    """
+    Compute the pk values of many (indicator, state) pairs across a pool of processes.
+
+    Parameters
+    ----------
+    xs : a list of lists, pandas.Series or 1-D numpy.ndarray.
+        Indicators.
+    ys : a list of lists, pandas.Series or 1-D numpy.ndarray.
+        States, ys[k] is the state of the indicator xs[k].
+    max_workers : int or None.
+        The process num of the pool, None for the cpu num.
+    chunk_size : int, default value is 16.
+        The num of calculate_pk() calls sent to a process at once.
+    method : string, default value is "numpy".
+        The engine used by calculate_pk().
+    keep_matrices : bool, default value is False.
+        Whether to save the rows * cols matrix in the returned dicts or not.
+
+    Returns
+    -------
+    answers : a list of dicts.
+        The return value of calculate_pk() for each pair, in the same order as xs and ys.
+
+    Notes
+    -----
+    All the cases are packed into two blocks of shared memory, so each process only
+    receives the offsets of its pairs instead of the pickled indicators and states.
+
+    """
+
+    assert len(xs) == len(ys), "xs and ys should contain the same num of pairs."
+    if len(xs) == 0:
+        return []
+
+    # check the pairs here as calculate_pk() does, the workers skip the check.
+    checked = [_check_xy(x, y) for x, y in zip(xs, ys)]
+    x_block = _SharedBlock([np.asarray(x, dtype=float) for x, _, _ in checked])
+    y_block = _SharedBlock([np.asarray(y, dtype=float) for _, y, _ in checked])
+    try:
+        tasks = [(x_block.spec, y_block.spec, [(k, checked[k][2]) for k in indices], method, keep_matrices)
+                 for indices in _chunks(range(len(xs)), chunk_size)]
+        return _run(_pk_chunk, tasks, max_workers)
+    finally:
+        x_block.release()
+        y_block.release()
+
+
+def compare_pks_parallel(pks, pairs = None, max_workers = None, chunk_size = 64):
+    """
+    Compare many pairs of pk results across a pool of processes.
+
+    Parameters
+    ----------
+    pks : a list of dicts.
+        The outputs of the function calculate_pk().
+    pairs : a list of tuples or None.
+        The (i, j) index pairs of pks to compare, None for all the pairs with i < j.
+    max_workers : int or None.
+        The process num of the pool, None for the cpu num.
+    chunk_size : int, default value is 64.
+        The num of compare_pks() calls sent to a process at once.
+
+    Returns
+    -------
+    answers : a list of dicts.
+        The return value of compare_pks() for each pair, in the same order as pairs.
+
+    Notes
+    -----
+    The PKm series of all the results are packed into one block of shared memory,
+    only the scalars PKj, SEj and n_case of each result are pickled.
+
+    """
+
+    for pk in pks:
+        assert isinstance(pk, Mapping) and pk.get("type", "unknown") == "pk", "pks must be the outputs of the function calculate_pk()."
+    assert all(pk.get("PKm") is not None for pk in pks), "The PKm of pks must be kept case by case."
+    if pairs is None:
+        pairs = list(itertools.combinations(range(len(pks)), 2))
+    if len(pairs) == 0:
+        return []
+
+    scalars = [(pk.get("n_case"), pk.get("PKj"), pk.get("SEj")) for pk in pks]
+    block = _SharedBlock([np.asarray(pk.get("PKm"), dtype=float) for pk in pks])
+    try:
+        tasks = [(block.spec, scalars, chunk) for chunk in _chunks(pairs, chunk_size)]
+        return _run(_pkc_chunk, tasks, max_workers)
+    finally:
+        block.release()
+
+
+class _SharedBlock(object):
+    """
+    Several 1-D float arrays packed one after another into a block of shared memory.
+    """
+
+    def __init__(self, arrays):
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(offsets[-1]) * 8, 8))
+        data = np.ndarray((offsets[-1],), dtype=float, buffer=self.shm.buf)
+        for k, a in enumerate(arrays):
+            data[offsets[k]:offsets[k + 1]] = a
+        del data
+        self.spec = (self.shm.name, offsets)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(spec):
+    """
+    Attach a block created by _SharedBlock in a worker process.
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory.
+        The attached block, to be closed once the views are dropped.
+    views : a function.
+        views(k) returns the k-th array of the block without copying it.
+
+    """
+
+    name, offsets = spec
+    shm = shared_memory.SharedMemory(name=name)
+    data = np.ndarray((offsets[-1],), dtype=float, buffer=shm.buf)
+    return shm, lambda k: data[offsets[k]:offsets[k + 1]]
+
+
+def _pk_chunk(x_spec, y_spec, items, method, keep_matrices):
+    """
+    calculate_pk() of the (k, index) items, the index of x being given back to the series of x.
+    """
+
+    x_shm, x_view = _attach(x_spec)
+    y_shm, y_view = _attach(y_spec)
+    try:
+        answers = []
+        for k, index in items:
+            x = x_view(k)
+            if index is not None:
+                x = pd.Series(x, index=index, copy=False)
+            answers.append(calculate_pk(x, y_view(k), auto_print=False, method=method,
+                                        keep_matrices=keep_matrices, validate=False))
+        return answers
+    finally:
+        # the views must be dropped before the blocks are closed.
+        x = x_view = y_view = None
+        x_shm.close()
+        y_shm.close()
+
+
+def _pkc_chunk(spec, scalars, pairs):
+    shm, view = _attach(spec)
+    try:
+        answers = []
+        for i, j in pairs:
+            pk1 = {"type": "pk", "n_case": scalars[i][0], "PKj": scalars[i][1], "SEj": scalars[i][2], "PKm": pd.Series(view(i), copy=False)}
+            pk2 = {"type": "pk", "n_case": scalars[j][0], "PKj": scalars[j][1], "SEj": scalars[j][2], "PKm": pd.Series(view(j), copy=False)}
+            answers.append(compare_pks(pk1, pk2, auto_print=False))
+        return answers
+    finally:
+        # the views must be dropped before the block is closed.
+        pk1 = pk2 = view = None
+        shm.close()
+
+
+def _chunks(items, chunk_size):
+    items = list(items)
+    assert chunk_size >= 1, "chunk_size should be at least 1."
+    return [items[k:k + chunk_size] for k in range(0, len(items), chunk_size)]
+
+
+def _run(func, tasks, max_workers):
+    """
+    Run func(*task) for each task in a process pool and join the returned lists in order.
+    """
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, *task) for task in tasks]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
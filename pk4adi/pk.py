@@ -6,31 +6,52 @@
 @License :   (C)Copyright 2004-2020, Zhejiang University
 """
 
+import sys
 import math
-import pandas as pd
+from collections.abc import Mapping
 import numpy as np
 from pk4adi.utils import print_table
+from pk4adi.profiling import _stage, _NULL
 
-__all__  = ["calculate_pk", "print_pk"]
+__all__  = ["calculate_pk", "calculate_pk_from_table", "print_pk", "PKResult"]
 
-def calculate_pk(x_in , y_in, auto_print = True):
+_INT64_MAX = np.iinfo(np.int64).max
+_WORD = 32
+# the bound of the int64 sums taken in float64, half of the max for the rounding of the bound.
+_SAFE_BOUND = 2.0 ** 62
+
+
+def calculate_pk(x_in , y_in, auto_print = True, method = "numpy", keep_matrices = True, validate = True):
     """
     Compute the pk value to Measure the Performance of Anesthetic Depth Indicators.
         print_pk() will be called before returning ans by default.
 
     Parameters
     ----------
-    x_in : a list or a pandas series (pandas.Series()).
+    x_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
         Indicator.
-    y_in : a list or a pandas series (pandas.Series()).
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
         State.
     auto_print : bool.
         Whether to print the ans before returning it or not.
+    method : string, default value is "numpy".
+        The engine used to build the matrix A, S, C, D and T.
+        "numpy" uses the vectorized engine based on np.unique() and 2-D cumulative sums.
+        "sparse" only works on the cells holding cases with the help of a Fenwick tree,
+        so the memory stays O(n) even if the indicator is continuous.
+        "reference" uses the original row by row implementation of the PKMACRO.xls,
+        which is much slower but could be used to check the other engines.
+    keep_matrices : bool, default value is True.
+        Whether to save the rows * cols matrix A, S, C, D and T in the ans or not.
+        Use keep_matrices = False together with method = "sparse" to keep the memory O(n).
+    validate : bool, default value is True.
+        Whether to check that x and y only contain numbers without nan or not.
+        Use validate = False to skip the checks for trusted inputs.
 
     Returns
     -------
-    ans : a dict.
-        A dict containing all the matrix and variables involved.
+    ans : a PKResult.
+        A read-only dict-like object containing all the matrix and variables involved.
         Use the script 'print(ans.keys())' to get the details.
         The most important variables have already been printed.
 
@@ -44,33 +65,230 @@ def calculate_pk(x_in , y_in, auto_print = True):
 
     """
 
-    ans = {}
-    ans.update({"type" : "pk"})
-    x = x_in
-    y = y_in
+    assert method in _ENGINES, "method should be one of %s." % ", ".join(_ENGINES)
 
     # check the input type of x and y.
-    assert isinstance(x, list) or isinstance(x, pd.Series) , "x should be a list or pandas.Series."
-    assert isinstance(y, list) or isinstance(y, pd.Series) ,  "y should be a list or pandas.Series."
-
-    # convert the list to pandas.Series if needed.
-    if isinstance(x_in, list):
-        x = pd.Series(x_in)
-    if isinstance(y_in, list):
-        y = pd.Series(y_in)
-
-    assert not x.apply(lambda n: not isinstance(n, (int, float))).any() , "x should not contain any non-num."
-    assert not y.apply(lambda n: not isinstance(n, (int, float))).any(), "y should not contain any non-num."
-    assert not x.isna().any() , "x should not contain any nan."
-    assert not y.isna().any(), "y should not contain any nan."
+    with _stage("calculate_pk", "validate"):
+        x, y, index = _check_xy(x_in, y_in, validate)
+
+    # construct the matrix A, S, C, D, T and the assist matrix SA, CA, DA, TA.
+    # the reference engine is timed as a whole, the others time their categorize and tables stages.
+    with _stage("calculate_pk", "tables") if method == "reference" else _NULL:
+        m = _ENGINES[method](x, y)
+
+    # calculate and save the matrix and variables.
+    ans = _pk_ans(m, index, method, keep_matrices)
+
+    # format and print.
+    if auto_print:
+        with _stage("calculate_pk", "print"):
+            print_pk(ans)
+
+    # return the ans.
+    return ans
+
+
+def calculate_pk_from_table(A, x_levels = None, y_levels = None, auto_print = True, method = "numpy", keep_matrices = True):
+    """
+    Compute the pk value from the counts of the cases in each (y, x) category, such as a crosstab.
+        print_pk() will be called before returning ans by default.
+
+    Parameters
+    ----------
+    A : a 2-D numpy.ndarray, a list of lists or a pandas.DataFrame.
+        The count matrix with one row per state level and one col per indicator level,
+        such as the output of pandas.crosstab(y, x).
+    x_levels : a list or a 1-D numpy.ndarray, default value is None.
+        The indicator value of each col, the columns of A for a pandas.DataFrame, otherwise 0, 1, ..., cols - 1.
+    y_levels : a list or a 1-D numpy.ndarray, default value is None.
+        The state value of each row, the index of A for a pandas.DataFrame, otherwise 0, 1, ..., rows - 1.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+    method : string, default value is "numpy".
+        The engine used to build the matrix C, D and T, "numpy" or "sparse" (see calculate_pk()).
+        Both of them take a time proportional to the size of A instead of the case num.
+    keep_matrices : bool, default value is True.
+        Whether to save the rows * cols matrix A, S, C, D and T in the ans or not.
+
+    Returns
+    -------
+    ans : a dict.
+        The same dict as the return value of calculate_pk(), but PKm is None and
+        PKm_cells gives the PKm value once for each non-empty cell instead, as a pandas.DataFrame
+        with the columns y, x, n (the case num of the cell) and PKm. PKj and SEj are weighted by n.
+
+    Notes
+    -----
+    The levels are sorted, and the empty rows and cols are dropped as they would not
+    appear among the cases, so the ans is the same as calculate_pk() of the expanded cases.
+
+    """
+
+    assert method in ["numpy", "sparse"], "method should be one of numpy, sparse."
+
+    pd = _pandas()
+    if pd is not None and isinstance(A, pd.DataFrame):
+        x_levels = A.columns.to_numpy() if x_levels is None else x_levels
+        y_levels = A.index.to_numpy() if y_levels is None else y_levels
+        A = A.to_numpy()
+    A = np.asarray(A)
+    assert A.ndim == 2, "A should be 2-D."
+    assert A.dtype.kind in "biuf" and np.isfinite(A).all(), "A should not contain any non-num or nan."
+    assert (A >= 0).all() and (A == np.floor(A)).all(), "A should only contain non-negative integer counts."
+    A = A.astype(int)
+
+    # sort the levels and drop the empty rows and cols.
+    x_levels = np.arange(A.shape[1]) if x_levels is None else _check_array(x_levels, "x_levels")
+    y_levels = np.arange(A.shape[0]) if y_levels is None else _check_array(y_levels, "y_levels")
+    assert len(x_levels) == A.shape[1] and len(y_levels) == A.shape[0], "x_levels and y_levels should match the shape of A."
+    assert len(np.unique(x_levels)) == len(x_levels) and len(np.unique(y_levels)) == len(y_levels), "The levels should be distinct."
+    x_order = np.argsort(x_levels)
+    y_order = np.argsort(y_levels)
+    A = A[y_order][:, x_order]
+    x_levels = x_levels[x_order]
+    y_levels = y_levels[y_order]
+    x_keep = A.sum(axis=0) > 0
+    y_keep = A.sum(axis=1) > 0
+    A = A[y_keep][:, x_keep]
+    rows, cols = A.shape
+    assert rows >= 2 , "The distinct values of y should be at least two."
+
+    # construct the matrix S, C, D, T and the assist matrix SA, CA, DA, TA.
+    if method == "numpy":
+        m = _dense_tables(A)
+    else:
+        cell_i, cell_j = np.nonzero(A)
+        m = _cell_tables(rows, cols, cell_i, cell_j, A[cell_i, cell_j])
+    ni = A.sum(axis=1)
+    m.update({"jack_ok": bool(rows > 2 or ni.min() >= 2), "x_levels": x_levels[x_keep], "y_levels": y_levels[y_keep]})
+
+    # calculate and save the matrix and variables.
+    ans = _pk_ans(m, None, method, keep_matrices)
+
+    # format and print.
+    if auto_print:
+        print_pk(ans)
+
+    # return the ans.
+    return ans
+
+
+def _check_xy(x_in, y_in, validate = True):
+    """
+    Check the indicator and the state, and convert them to numpy.ndarray without copying if possible.
+
+    Parameters
+    ----------
+    x_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        Indicator.
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        State.
+    validate : bool, default value is True.
+        Whether to check that x and y only contain numbers without nan or not.
+
+    Returns
+    -------
+    x, y : numpy.ndarray.
+    index : a pandas.Index or None.
+        The index of x if it is a pandas.Series, None for 0, 1, ..., n_case - 1.
+
+    """
+
+    pd = _pandas()
+    index = x_in.index if pd is not None and isinstance(x_in, pd.Series) else None
+    x = _check_array(x_in, "x", validate)
+    y = _check_array(y_in, "y", validate)
     assert len(x) == len(y) , "x and y should contain the same cases."
     assert len(x) >= 2 , "x and y should contain at least two cases."
 
-    # get n_cases.
+    return x, y, index
+
+
+def _check_array(v, name, validate = True):
+    """
+    Convert a 1-D input to numpy.ndarray and check it by its dtype.
+
+    Lists (also of numpy scalars), tuples, numpy.ndarray, memoryview and other buffers are
+    accepted, as well as pandas.Series of numpy or nullable (such as Int64) dtypes.
+    numpy.ndarray, buffers and pandas.Series of numpy dtypes are not copied.
+
+    Parameters
+    ----------
+    v : a 1-D array-like.
+        The input.
+    name : string.
+        The name of the input used in the messages.
+    validate : bool, default value is True.
+        Whether to check that v only contains numbers without nan or not.
+        If not, the missing values of a nullable pandas.Series are converted to nan.
+
+    Returns
+    -------
+    v : numpy.ndarray.
+
+    """
+
+    assert not isinstance(v, (str, bytes, dict, set)), "%s should be a list, pandas.Series, numpy.ndarray or a buffer." % name
+    pd = _pandas()
+    if pd is not None and isinstance(v, pd.Series):
+        if isinstance(v.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(v.dtype):
+            hasnans = bool(v.hasnans)
+            assert not (validate and hasnans), "%s should not contain any nan." % name
+            # without the checks, the missing values are given as nan in a float array.
+            v = v.to_numpy(dtype=float, na_value=np.nan) if hasnans else v.to_numpy(dtype=getattr(v.dtype, "numpy_dtype", float))
+        else:
+            v = v.to_numpy()
+    else:
+        v = np.asarray(v)
+    assert v.ndim == 1, "%s should be 1-D." % name
+
+    if validate:
+        if v.dtype == object:
+            assert all(isinstance(n, (int, float, np.number)) for n in v), "%s should not contain any non-num." % name
+            v = v.astype(float)
+        assert v.dtype.kind in "biuf", "%s should not contain any non-num." % name
+        assert v.dtype.kind != "f" or not np.isnan(v).any(), "%s should not contain any nan." % name
+
+    return v
+
+
+def _pandas():
+    """
+    The pandas module if it has been imported, None otherwise.
+
+    The inputs could not be any pandas object before pandas is imported, so the checks
+    do not need to import it, and the numpy inputs never load pandas.
+
+    """
+
+    return sys.modules.get("pandas")
+
+
+def _reference_engine(x, y):
+    """
+    Build the matrix A, S, C, D and T row by row, following the PKMACRO.xls.
+
+    Parameters
+    ----------
+    x : numpy.ndarray.
+        Indicator.
+    y : numpy.ndarray.
+        State.
+
+    Returns
+    -------
+    m : a dict.
+        The matrix, the assist matrix, the category codes Ry and Cx of every case,
+        the shape of the matrix and whether jackknife could be done or not.
+
+    """
+
+    import pandas as pd
+
     n_case = len(x)
 
     # construct basic matrix.
-    data = pd.DataFrame({"x": x, "y": y, "k": range(n_case), "Ry": [0] * n_case,"Cx": [0] * n_case, "PKm": [0] * n_case})
+    data = pd.DataFrame({"x": pd.Series(x), "y": pd.Series(y), "k": range(n_case), "Ry": [0] * n_case,"Cx": [0] * n_case})
 
     # check y and set the category.
     data.sort_values("y", inplace=True)
@@ -167,104 +385,858 @@ def calculate_pk(x_in , y_in, auto_print = True):
         DA[0, 1] = DA[0, 1] + DA[i, 0]
         TA[0, 1] = TA[0, 1] + TA[i, 0]
 
-    # calculate.
-    n = SA[0, 0]
-    Qc = CA[0, 1]
-    Qd = DA[0, 1]
-    Qtx = TA[0, 1]
-    Qcdt = Qc + Qd + Qtx
-    dyx = (Qc - Qd) / Qcdt
-    PK = (dyx + 1) / 2
-    Qcc = CA[1, 1]
-    Qdd = DA[1, 1]
-    Qcd = TA[1, 1]
-    Term1 = Qcc - 2 * Qcd + Qdd
-    Term2 = 0
-    Term3 = 0
+    return {"rows": rows, "cols": cols, "jack_ok": jack_ok,
+            "Ry": data["Ry"].to_numpy(), "Cx": data["Cx"].to_numpy(),
+            "A": A, "S": S, "C": C, "D": D, "T": T,
+            "SA": SA, "CA": CA, "DA": DA, "TA": TA}
+
+
+def _factorize_y(y):
+    """
+    Set the category of y, which is shared by all the indicators assessed against the same state.
 
+    Parameters
+    ----------
+    y : numpy.ndarray.
+        State.
+
+    Returns
+    -------
+    fy : a dict.
+        rows : the distinct value num of y, i.e. the row num for the matrix.
+        Ry : the category of each case.
+        ni : the case num of each category.
+        jack_ok : whether jackknife could be done or not.
+
+    """
+
+    with _stage("calculate_pk", "categorize"):
+        y_values, Ry, ni = np.unique(y, return_inverse=True, return_counts=True)
+    rows = len(y_values)
+    assert rows >= 2 , "The distinct values of y should be at least two."
+    jack_ok = bool(rows > 2 or ni.min() >= 2)
+    return {"rows": rows, "Ry": Ry.reshape(-1), "ni": ni.astype(int), "jack_ok": jack_ok}
+
+
+def _numpy_engine(x, y):
+    """
+    Build the matrix A, S, C, D and T with vectorized numpy operations.
+
+    The categories come from np.unique(), the matrix A from np.bincount() and the
+    matrix C, D and T from the 2-D cumulative sums of A, which takes O(n log n + rows * cols)
+    instead of the O(n + rows * rows * cols) python loops of the reference engine.
+
+    Parameters
+    ----------
+    x : numpy.ndarray.
+        Indicator.
+    y : numpy.ndarray.
+        State.
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _reference_engine().
+
+    """
+
+    return _numpy_tables(_factorize_y(y), x)
+
+
+def _numpy_tables(fy, x):
+    """
+    The numpy engine working on a factorized y, which could be shared by many indicators.
+
+    Parameters
+    ----------
+    fy : a dict.
+        The return value of _factorize_y().
+    x : numpy.ndarray.
+        Indicator.
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _reference_engine().
+
+    """
+
+    rows = fy["rows"]
+    Ry = fy["Ry"]
+
+    # check x and set the category.
+    with _stage("calculate_pk", "categorize"):
+        x_values, Cx = np.unique(x, return_inverse=True)
+    Cx = Cx.reshape(-1)
+    cols = len(x_values)
+
+    # construct matrix A.
+    with _stage("calculate_pk", "tables"):
+        A = np.bincount(Ry * cols + Cx, minlength=rows * cols).reshape(rows, cols).astype(int)
+        m = _dense_tables(A)
+    m.update({"jack_ok": fy["jack_ok"], "Ry": Ry, "Cx": Cx})
+    return m
+
+
+def _dense_tables(A):
+    """
+    Build the matrix S, C, D, T and the assist matrix from the count matrix A.
+
+    Parameters
+    ----------
+    A : numpy.ndarray.
+        The count matrix with the shape (rows, cols).
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _reference_engine(),
+        except jack_ok and the categories Ry and Cx of the cases.
+
+    """
+
+    rows, cols = A.shape
+    S = np.cumsum(A, axis=1)
+
+    # K[i, j] is the count of the cases with the y category < i and the x category < j.
+    K = np.zeros((rows + 1, cols + 1), dtype=int)
+    K[1:, 1:] = np.cumsum(S, axis=0)
+    n = K[rows, cols]
+
+    # count the cases located in the four quadrants around each cell.
+    lower_left = K[:rows, :cols]
+    lower_right = K[:rows, cols][:, None] - K[:rows, 1:]
+    upper_left = K[rows, :cols][None, :] - K[1:, :cols]
+    upper_right = n - K[1:, cols][:, None] - K[rows, 1:][None, :] + K[1:, 1:]
+
+    # construct matrix C, D and T, only the cells holding cases are filled as the reference does.
+    mask = A != 0
+    C = np.where(mask, lower_left + upper_right, 0)
+    D = np.where(mask, lower_right + upper_left, 0)
+    T = np.where(mask, A.sum(axis=0)[None, :] - A, 0)
+
+    # construct the assist matrix SA, CA, DA and TA.
+    m = _assist_matrix(rows, n, (A * C).sum(axis=1), (A * D).sum(axis=1), (A * T).sum(axis=1),
+                       _exact_sum(A, C, C), _exact_sum(A, D, D), _exact_sum(A, C, D))
+    m.update({"rows": rows, "cols": cols, "A": A, "S": S, "C": C, "D": D, "T": T})
+    return m
+
+
+def _sparse_engine(x, y):
+    """
+    Compute the cell values of C, D and T without materializing any rows * cols matrix.
+
+    The cases are reduced to the sorted non-zero cells (i, j) of the matrix A. The rows are
+    visited from the lowest y category on, and a Fenwick tree over the x categories holds the
+    counts of the rows already visited, so the cases located in the four quadrants around each
+    cell are given by prefix queries. Both time and memory stay O(n log n) and O(n).
+
+    Parameters
+    ----------
+    x : numpy.ndarray.
+        Indicator.
+    y : numpy.ndarray.
+        State.
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _reference_engine(), except that the
+        matrix A, S, C, D and T are replaced by the cell arrays (see _cells_from_dense()).
+
+    """
+
+    return _sparse_tables(_factorize_y(y), x)
+
+
+def _sparse_tables(fy, x):
+    """
+    The sparse engine working on a factorized y, which could be shared by many indicators.
+
+    Parameters
+    ----------
+    fy : a dict.
+        The return value of _factorize_y().
+    x : numpy.ndarray.
+        Indicator.
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _sparse_engine().
+
+    """
+
+    rows = fy["rows"]
+    Ry = fy["Ry"]
+
+    # check x and set the category.
+    with _stage("calculate_pk", "categorize"):
+        x_values, Cx = np.unique(x, return_inverse=True)
+    Cx = Cx.reshape(-1)
+    cols = len(x_values)
+
+    # reduce the cases to the non-zero cells of A, sorted by row then by col.
+    with _stage("calculate_pk", "tables"):
+        keys, cell, cell_a = np.unique(Ry.astype(np.int64) * cols + Cx, return_inverse=True, return_counts=True)
+        m = _cell_tables(rows, cols, keys // cols, keys % cols, cell_a.astype(int))
+    m.update({"jack_ok": fy["jack_ok"], "Ry": Ry, "Cx": Cx, "cell": cell.reshape(-1)})
+    return m
+
+
+def _cell_tables(rows, cols, cell_i, cell_j, cell_a):
+    """
+    Compute the cell values of C, D, T and the assist matrix from the non-zero cells of A.
+
+    Parameters
+    ----------
+    rows, cols : int.
+        The shape of the matrix A.
+    cell_i, cell_j, cell_a : numpy.ndarray.
+        The row, the col and the case num of each non-zero cell, sorted by row then by col.
+
+    Returns
+    -------
+    m : a dict.
+        The same contents as the return value of _sparse_engine(),
+        except jack_ok, the categories Ry and Cx and the cell of the cases.
+
+    """
+
+    ni = np.bincount(cell_i, weights=cell_a, minlength=rows).astype(int)
+    nj = np.bincount(cell_j, weights=cell_a, minlength=cols).astype(int)
+    n = int(ni.sum())
+
+    # the cases with a lower y category, with a lower x category and in the same row left to the cell.
+    y_less = (np.cumsum(ni) - ni)[cell_i]
+    x_less = (np.cumsum(nj) - nj)[cell_j]
+    row_start = np.searchsorted(cell_i, np.arange(rows + 1))
+    row_left = np.cumsum(cell_a) - cell_a - (np.cumsum(ni) - ni)[cell_i]
+    row_right = ni[cell_i] - row_left - cell_a
+
+    # count the cases with a lower y category and a lower (or equal) x category.
+    lower_left = np.zeros(len(cell_a), dtype=int)
+    lower_equal = np.zeros(len(cell_a), dtype=int)
+    tree = np.zeros(cols + 1, dtype=int)
     for i in range(rows):
-        ni = S[i, cols - 1]
-        Qci = CA[i, 0]
-        Qdi = DA[i, 0]
-        Term2 = Term2 + (n - ni) * (Qci - Qdi)
-        Term3 = Term3 + ni * (n - ni) * (n - ni)
-
-    Term2 = -2 * dyx * Term2
-    Term3 = dyx * dyx * Term3
-    SE1 = math.sqrt(Term1 + Term2 + Term3) / Qcdt
-    SE0 = math.sqrt(Term1 - (Qc - Qd) * (Qc - Qd) / n) / Qcdt
-
-
-    SPKm = np.nan
-    SSPKm = np.nan
-    PKj = np.nan
-    SEj = np.nan
-
-    # do jackknife.
-    if jack_ok:
-        SPKm = 0
-        SSPKm = 0
-
-        for k in range(n_case):
-            i = data.iloc[k, 3]
-            j = data.iloc[k, 4]
-            Crc = C[i, j]
-            Drc = D[i, j]
-            Trc = T[i, j]
-            Qcm = Qc - 2 * Crc
-            Qdm = Qd - 2 * Drc
-            Qtxm = Qtx - 2 * Trc
-            Qcdtm = Qcm + Qdm + Qtxm
-            PKm = (Qcm + Qtxm / 2) / Qcdtm
-            data.iloc[k, 5] = PKm
-            SPKm = SPKm + PKm
-            SSPKm = SSPKm + PKm * PKm
-
-        PKj = n_case * PK -(n_case - 1) * SPKm / n_case
-        SEj = math.sqrt((n_case - 1) * (SSPKm - SPKm * SPKm / n_case) / n_case)
-
-
-    # save the matrix.
-    ans.update({"A" : A})
-    ans.update({"S" : S})
-    ans.update({"C" : C})
-    ans.update({"D" : D})
-    ans.update({"T" : T})
-    ans.update({"SA" : SA})
-    ans.update({"CA" : CA})
-    ans.update({"DA" : DA})
-    ans.update({"TA" : TA})
-
-    # save the variables.
-    ans.update({"jack_ok" : jack_ok})
-    ans.update({"n_case": n_case})
-    ans.update({"n" : n})
-    ans.update({"Qc" : Qc})
-    ans.update({"Qd" : Qd})
-    ans.update({"Qtx" : Qtx})
-    ans.update({"Qcdt" : Qcdt})
-    ans.update({"dyx" : dyx})
-    ans.update({"PK" : PK})
-    ans.update({"Qcc" : Qcc})
-    ans.update({"Qdd" : Qdd})
-    ans.update({"Qcd" : Qcd})
-    ans.update({"Term1" : Term1})
-    ans.update({"Term2" : Term2})
-    ans.update({"Term3" : Term3})
-    ans.update({"SE1" : SE1})
-    ans.update({"SE0" : SE0})
-    ans.update({"PKm" : data["PKm"]})
-    ans.update({"SPKm" : SPKm})
-    ans.update({"SSPKm" : SSPKm})
-    ans.update({"PKj" : PKj})
-    ans.update({"SEj" : SEj})
+        seg = slice(row_start[i], row_start[i + 1])
+        lower_left[seg] = _fenwick_query(tree, cell_j[seg])
+        lower_equal[seg] = _fenwick_query(tree, cell_j[seg] + 1)
+        _fenwick_add(tree, cell_j[seg] + 1, cell_a[seg])
 
-    # format and print.
-    if auto_print:
-        print_pk(ans)
+    lower_right = y_less - lower_equal
+    upper_left = x_less - lower_left - row_left
+    upper_right = n - x_less - nj[cell_j] - lower_right - row_right
+
+    # the cell values of C, D and T.
+    cell_c = lower_left + upper_right
+    cell_d = lower_right + upper_left
+    cell_t = nj[cell_j] - cell_a
+
+    # construct the assist matrix SA, CA, DA and TA.
+    starts = row_start[:-1]
+    m = _assist_matrix(rows, n, np.add.reduceat(cell_a * cell_c, starts), np.add.reduceat(cell_a * cell_d, starts),
+                       np.add.reduceat(cell_a * cell_t, starts), _exact_sum(cell_a, cell_c, cell_c),
+                       _exact_sum(cell_a, cell_d, cell_d), _exact_sum(cell_a, cell_c, cell_d))
+    m.update({"rows": rows, "cols": cols, "ni": ni,
+              "cell_i": cell_i, "cell_j": cell_j, "cell_a": cell_a,
+              "cell_c": cell_c, "cell_d": cell_d, "cell_t": cell_t})
+    return m
+
+
+def _assist_matrix(rows, n, ca, da, ta, Qcc, Qdd, Qcd):
+    """
+    Construct the assist matrix SA, CA, DA and TA as the reference does.
+
+    Parameters
+    ----------
+    rows : int.
+        The row num of the matrix A.
+    n : int.
+        The case num.
+    ca, da, ta : numpy.ndarray.
+        The row sums of A * C, A * D and A * T.
+    Qcc, Qdd, Qcd : int.
+        The sums of A * C * C, A * D * D and A * C * D, the return values of _exact_sum().
+
+    Returns
+    -------
+    m : a dict.
+        SA, CA, DA and TA. They hold Python ints (dtype object) if Qcc, Qdd or Qcd is out of the range of int64.
+
+    """
+
+    dtype = int if max(Qcc, Qdd, Qcd) <= _INT64_MAX else object
+    SA = np.zeros((rows, 2), dtype=dtype)
+    CA = np.zeros((rows, 2), dtype=dtype)
+    DA = np.zeros((rows, 2), dtype=dtype)
+    TA = np.zeros((rows, 2), dtype=dtype)
+    CA[:, 0] = ca
+    DA[:, 0] = da
+    TA[:, 0] = ta
+    SA[0, 0] = n
+    CA[0, 1] = int(ca.sum())
+    DA[0, 1] = int(da.sum())
+    TA[0, 1] = int(ta.sum())
+    CA[1, 1] = Qcc
+    DA[1, 1] = Qdd
+    TA[1, 1] = Qcd
+    return {"SA": SA, "CA": CA, "DA": DA, "TA": TA}
+
+
+def _exact_sum(a, u, v, axis = None):
+    """
+    The sum of a * u * v over integer arrays, exact even out of the range of int64.
+
+    The sum is bounded by sum(|a * u|) * max(|v|) first and computed in int64 if the bound fits,
+    as for most data. Otherwise each product is split into two words, hi * 2**32 + lo, by int64
+    multiplies, the words are summed separately and only the sums are combined as Python ints.
+    The bounds are taken in float64 with a margin of 2 against rounding, so they do not wrap.
+    If |a * u| >= 2**62, |v| >= 2**31 or the sums of the words may leave int64 too,
+    the products are taken as Python ints (dtype object).
+
+    Parameters
+    ----------
+    a, u, v : numpy.ndarray.
+        Integer arrays of the same shape.
+    axis : int, tuple of ints or None, default value is None.
+        The axes summed over, None for all of them.
+
+    Returns
+    -------
+    total : int, or a numpy.ndarray if axis is given.
+        The dtype of the array is object if the sums are out of the range of int64.
+
+    """
+
+    if a.dtype.kind == "f" or u.dtype.kind == "f" or v.dtype.kind == "f" or a.size == 0:
+        total = (a * u * v).sum(axis=axis)
+        return total.item() if axis is None else total
+
+    a_max, u_max, v_max = int(np.abs(a).max()), int(np.abs(u).max()), int(np.abs(v).max())
+    if a_max * u_max < 2**62 and v_max < 2**31:
+        p = np.abs(a * u)
+        if float(p.sum(dtype=np.float64)) * v_max <= _SAFE_BOUND:
+            total = (a * u * v).sum(axis=axis)
+            return int(total) if axis is None else total
+        # the hi words are at most (p >> 32) * |v| + 2**31 each, the lo words below 2**32 each.
+        hi_bound = float((p >> _WORD).sum(dtype=np.float64)) * v_max + p.size * 2.0 ** 31
+        if hi_bound <= _SAFE_BOUND and p.size * 2.0 ** _WORD <= _SAFE_BOUND:
+            return _split_sum(np.sign(a) * np.sign(u) * np.sign(v), p, v, axis)
+
+    total = (a.astype(object) * u.astype(object) * v.astype(object)).sum(axis=axis)
+    return int(total) if axis is None else np.asarray(total, dtype=object)
+
+
+def _split_sum(sign, p, v, axis):
+    """
+    The sum of sign * p * |v| by _exact_sum(), with p >= 0, each product split into two words.
+    """
+
+    # p * |v| = (ph * |v| + (pl * |v| >> 32)) * 2**32 + (pl * |v| & mask), both words fit in int64.
+    w = np.abs(v).astype(np.uint64)
+    mask = (1 << _WORD) - 1
+    q = (p & mask).astype(np.uint64) * w
+    hi = (sign * ((p >> _WORD) * w.astype(np.int64) + (q >> np.uint64(_WORD)).astype(np.int64))).sum(axis=axis)
+    lo = (sign * (q & np.uint64(mask)).astype(np.int64)).sum(axis=axis)
+    if axis is None:
+        return (int(hi) << _WORD) + int(lo)
+    return np.asarray(hi, dtype=object) * (1 << _WORD) + np.asarray(lo, dtype=object)
+
+
+def _jackknife_cells(Qc, Qd, Qtx, cell_c, cell_d, cell_t):
+    """
+    Compute the PK value after removing one case located in each cell.
+
+    Parameters
+    ----------
+    Qc, Qd, Qtx : int.
+        The concordant, discordant and x-only tied pair counts of all the cases.
+    cell_c, cell_d, cell_t : numpy.ndarray.
+        The values of C, D and T of each cell.
+
+    Returns
+    -------
+    cell_pkm : numpy.ndarray.
+        The PKm value of each cell.
+
+    """
+
+    Qcm = Qc - 2 * cell_c
+    Qdm = Qd - 2 * cell_d
+    Qtxm = Qtx - 2 * cell_t
+    Qcdtm = Qcm + Qdm + Qtxm
+    return (Qcm + Qtxm / 2) / Qcdtm
+
+
+def _jackknife_sums(n_case, PK, cell_a, cell_pkm):
+    """
+    Reduce the PKm values of the cells to SPKm, SSPKm, PKj and SEj.
+
+    The sums are exactly rounded by math.fsum() and SEj uses the centered sum of squares,
+    so a large n_case does not drift from the case by case result.
+
+    Parameters
+    ----------
+    n_case : int.
+        The case num.
+    PK : float.
+        The pk value of all the cases.
+    cell_a : numpy.ndarray.
+        The case num of each cell.
+    cell_pkm : numpy.ndarray.
+        The PKm value of each cell, the return value of _jackknife_cells().
+
+    Returns
+    -------
+    SPKm, SSPKm, PKj, SEj : float.
+
+    """
+
+    SPKm = math.fsum(cell_a * cell_pkm)
+    SSPKm = math.fsum(cell_a * cell_pkm * cell_pkm)
+    PKj = n_case * PK -(n_case - 1) * SPKm / n_case
+    SEj = math.sqrt((n_case - 1) * math.fsum(cell_a * (cell_pkm - SPKm / n_case) ** 2) / n_case)
+    return SPKm, SSPKm, PKj, SEj
+
+
+def _cell_e(A):
+    """
+    E = C - D of every cell of the count matrix A, filled for the empty cells as well.
+
+    Parameters
+    ----------
+    A : numpy.ndarray.
+        The count matrix with the shape (rows, cols), or a stack of them with the shape (..., rows, cols).
+
+    Returns
+    -------
+    E : numpy.ndarray.
+        The same shape as A.
+
+    """
+
+    # h[r, j] = (cases of row r with a lower x) - (cases of row r with a higher x).
+    S = np.cumsum(A, axis=-1)
+    h = (S - A) - (S[..., -1:] - S)
+
+    # E[i, j] = sum of h over the lower rows - sum of h over the higher rows.
+    if h.shape[-2] == 0:
+        return h
+    H = np.cumsum(h, axis=-2)
+    return (H - h) - (H[..., -1:, :] - H)
+
+
+def _pk_of_tables(A):
+    """
+    The pk values of a stack of count matrix.
+
+    Parameters
+    ----------
+    A : numpy.ndarray.
+        The stack of count matrix with the shape (..., rows, cols).
+
+    Returns
+    -------
+    PK : numpy.ndarray.
+        The pk value of each matrix with the shape (...), nan if it holds less than two states.
+
+    """
+
+    ni = A.sum(axis=-1)
+    nj = A.sum(axis=-2)
+    n = ni.sum(axis=-1)
+    Qcd = (A * _cell_e(A)).sum(axis=(-2, -1))
+    both = (A * (n[..., None, None] - ni[..., :, None] - nj[..., None, :] + A)).sum(axis=(-2, -1))
+    Qtx = (A * (nj[..., None, :] - A)).sum(axis=(-2, -1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (Qcd / (both + Qtx) + 1) / 2
+
+
+def _stats_of_tables(A):
+    """
+    PK, SE0, SE1 and the jackknife of a stack of count matrix, without any loop over the stack.
+
+    Everything is derived from A and E = C - D, since C + D = n - ni - nj + A and T = nj - A
+    for the cells holding cases. The zero rows and cols padding the matrix have no effect.
+
+    Parameters
+    ----------
+    A : numpy.ndarray.
+        The stack of count matrix with the shape (..., rows, cols).
+
+    Returns
+    -------
+    stats : a dict.
+        n_case, PK, SE0, SE1, jack_ok, PKj and SEj of each matrix with the shape (...),
+        nan if it holds less than two states (or if jack_ok is False for PKj and SEj).
+
+    """
+
+    ni = A.sum(axis=-1)
+    nj = A.sum(axis=-2)
+    n = ni.sum(axis=-1)
+    E = _cell_e(A)
+    CD = n[..., None, None] - ni[..., :, None] - nj[..., None, :] + A
+    T = nj[..., None, :] - A
+
+    # the pair counts.
+    Qc_Qd = (A * E).sum(axis=(-2, -1))
+    Qcd = (A * CD).sum(axis=(-2, -1))
+    Qtx = (A * T).sum(axis=(-2, -1))
+    Qc = (Qcd + Qc_Qd) // 2
+    Qd = (Qcd - Qc_Qd) // 2
+    Qcdt = Qcd + Qtx
+    Term1 = _exact_sum(A, E, E, axis=(-2, -1))
+    rest = n[..., None] - ni
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dyx = Qc_Qd / Qcdt
+        PK = (dyx + 1) / 2
+        Term2 = -2 * dyx * (rest * (A * E).sum(axis=-1).astype(float)).sum(axis=-1)
+        Term3 = dyx * dyx * (ni * rest.astype(float) * rest).sum(axis=-1)
+        if Term1.dtype == object:
+            # Term1 is out of the range of int64, subtract exactly before rounding.
+            Var0 = ((Term1 * n.astype(object) - Qc_Qd.astype(object) ** 2) / n.astype(object)).astype(float)
+            Term1 = Term1.astype(float)
+        else:
+            Var0 = Term1 - Qc_Qd.astype(float) ** 2 / n
+        SE1 = np.sqrt(Term1 + Term2 + Term3) / Qcdt
+        SE0 = np.sqrt(Var0) / Qcdt
+
+        # whether jackknife could be done or not, as _factorize_y() does.
+        rows = (ni > 0).sum(axis=-1)
+        ni_min = np.where(ni > 0, ni, np.iinfo(ni.dtype).max).min(axis=-1)
+        jack_ok = (rows > 2) | ((rows == 2) & (ni_min >= 2))
+
+        # do jackknife in closed form over the cells, see _jackknife_cells() and _jackknife_sums().
+        Qcm = Qc[..., None, None] - (CD + E)
+        Qdm = Qd[..., None, None] - (CD - E)
+        Qtxm = Qtx[..., None, None] - 2 * T
+        cell_pkm = np.where(A > 0, (Qcm + Qtxm / 2) / (Qcm + Qdm + Qtxm), 0)
+        SPKm = (A * cell_pkm).sum(axis=(-2, -1))
+        mean = SPKm / n
+        PKj = np.where(jack_ok, n * PK - (n - 1) * mean, np.nan)
+        SEj = np.where(jack_ok, np.sqrt((n - 1) * (A * (cell_pkm - mean[..., None, None]) ** 2).sum(axis=(-2, -1)) / n), np.nan)
+
+    PK = np.where(rows >= 2, PK, np.nan)
+    return {"n_case": n, "PK": PK, "SE0": np.where(rows >= 2, SE0, np.nan), "SE1": np.where(rows >= 2, SE1, np.nan),
+            "jack_ok": jack_ok, "PKj": PKj, "SEj": SEj}
+
+
+def _fenwick_query(tree, pos):
+    """
+    Vectorized prefix sums of a Fenwick tree, the sum of the first pos[k] items for each k.
+    """
+
+    out = np.zeros(len(pos), dtype=tree.dtype)
+    pos = np.array(pos, dtype=np.int64)
+    while pos.any():
+        out += tree[pos]
+        pos -= pos & -pos
+    return out
+
+
+def _fenwick_add(tree, pos, values):
+    """
+    Vectorized point updates of a Fenwick tree, add values[k] to the item pos[k] (1-based).
+    """
+
+    pos = np.array(pos, dtype=np.int64)
+    values = np.asarray(values)
+    while len(pos):
+        np.add.at(tree, pos, values)
+        pos = pos + (pos & -pos)
+        keep = pos < len(tree)
+        pos = pos[keep]
+        values = values[keep]
+
+
+def _cells_from_dense(m):
+    """
+    Extract the non-zero cells of the matrix A, C, D and T built by a dense engine.
+
+    Parameters
+    ----------
+    m : a dict.
+        The return value of _reference_engine() or _numpy_engine().
+
+    Returns
+    -------
+    cells : a dict.
+        ni : the case num of each row.
+        cell_i, cell_j, cell_a, cell_c, cell_d, cell_t : the row, col and the values of
+            A, C, D and T of each non-zero cell, sorted by row then by col.
+        cell : the index of the cell each case is located in, only if the categories
+            Ry and Cx of the cases are known.
+
+    """
+
+    A = m["A"]
+    rows, cols = A.shape
+    cell_i, cell_j = np.nonzero(A)
+    cells = {"ni": m["S"][:, cols - 1],
+             "cell_i": cell_i, "cell_j": cell_j, "cell_a": A[cell_i, cell_j],
+             "cell_c": m["C"][cell_i, cell_j], "cell_d": m["D"][cell_i, cell_j],
+             "cell_t": m["T"][cell_i, cell_j]}
+    if "Ry" in m:
+        index = np.full(rows * cols, -1, dtype=np.int64)
+        index[cell_i * cols + cell_j] = np.arange(len(cell_i))
+        cells["cell"] = index[np.asarray(m["Ry"]) * cols + np.asarray(m["Cx"])]
+    return cells
+
+
+def _dense_from_cells(m):
+    """
+    Materialize the rows * cols matrix A, S, C, D and T from the cell arrays.
+    """
+
+    shape = (m["rows"], m["cols"])
+    index = (m["cell_i"], m["cell_j"])
+    dense = {}
+    for name in ["A", "C", "D", "T"]:
+        matrix = np.zeros(shape, dtype=int)
+        matrix[index] = m["cell_" + name.lower()]
+        dense[name] = matrix
+    dense["S"] = np.cumsum(dense["A"], axis=1)
+    return dense
+
+
+_ENGINES = {"numpy": _numpy_engine, "sparse": _sparse_engine, "reference": _reference_engine}
+
+
+def _pk_ans(m, index, method = "numpy", keep_matrices = True):
+    """
+    Calculate the PK, the SEs and the jackknife from the matrix built by an engine.
+
+    Parameters
+    ----------
+    m : a dict.
+        The return value of an engine, such as _numpy_engine().
+    index : a pandas.Index or None.
+        The index of the cases used by the PKm series, None for 0, 1, ..., n_case - 1.
+        If only the counts of the cells are known (m holds no Ry), PKm is None and PKm_cells
+        gives the PKm value of each cell, labelled by the x_levels and y_levels of m.
+    method : string.
+        The name of the engine, the jackknife is done case by case for "reference".
+    keep_matrices : bool.
+        Whether to save the rows * cols matrix A, S, C, D and T in the ans or not.
+
+    Returns
+    -------
+    ans : a PKResult.
+        The same as the return value of calculate_pk().
+
+    """
+
+    n_case = int(m["SA"][0, 0])
+
+    with _stage("calculate_pk", "variance"):
+        if "cell_a" not in m:
+            m.update(_cells_from_dense(m))
+        rows = m["rows"]
+        SA = m["SA"]
+        CA = m["CA"]
+        DA = m["DA"]
+        TA = m["TA"]
+        cell = m.get("cell")
+        cell_c = m["cell_c"]
+        cell_d = m["cell_d"]
+        cell_t = m["cell_t"]
+        jack_ok = m["jack_ok"]
+
+        # calculate, the scalars are Python ints so the squares of the pair counts do not overflow.
+        n = int(SA[0, 0])
+        Qc = int(CA[0, 1])
+        Qd = int(DA[0, 1])
+        Qtx = int(TA[0, 1])
+        Qcdt = Qc + Qd + Qtx
+        dyx = (Qc - Qd) / Qcdt
+        PK = (dyx + 1) / 2
+        Qcc = int(CA[1, 1])
+        Qdd = int(DA[1, 1])
+        Qcd = int(TA[1, 1])
+        Term1 = Qcc - 2 * Qcd + Qdd
+
+        # the sums over the rows of (n - ni) * (Qci - Qdi) and ni * (n - ni) * (n - ni).
+        ni = np.asarray(m["ni"], dtype=np.int64)
+        rest = n - ni
+        Term2 = _exact_sum(np.ones_like(rest), (CA[:, 0] - DA[:, 0]).astype(np.int64), rest)
+        Term3 = _exact_sum(ni, rest, rest)
+
+        Term2 = -2 * dyx * Term2
+        Term3 = dyx * dyx * Term3
+        SE1 = math.sqrt(Term1 + Term2 + Term3) / Qcdt
+        SE0 = math.sqrt((Term1 * n - (Qc - Qd) * (Qc - Qd)) / n) / Qcdt
+
+    with _stage("calculate_pk", "jackknife"):
+        SPKm = np.nan
+        SSPKm = np.nan
+        PKj = np.nan
+        SEj = np.nan
+        cell_pkm = None
+
+        # do jackknife in closed form, PKm only depends on the cell the removed case is located in.
+        if jack_ok and method != "reference":
+            cell_pkm = _jackknife_cells(Qc, Qd, Qtx, cell_c, cell_d, cell_t)
+            SPKm, SSPKm, PKj, SEj = _jackknife_sums(n_case, PK, m["cell_a"], cell_pkm)
+
+        # do jackknife case by case as the PKMACRO.xls does.
+        elif jack_ok:
+            SPKm = 0
+            SSPKm = 0
+            cell_pkm = np.zeros(len(cell_c))
+
+            for k in range(n_case):
+                Crc = cell_c[cell[k]]
+                Drc = cell_d[cell[k]]
+                Trc = cell_t[cell[k]]
+                Qcm = Qc - 2 * Crc
+                Qdm = Qd - 2 * Drc
+                Qtxm = Qtx - 2 * Trc
+                Qcdtm = Qcm + Qdm + Qtxm
+                PKm = (Qcm + Qtxm / 2) / Qcdtm
+                cell_pkm[cell[k]] = PKm
+                SPKm = SPKm + PKm
+                SSPKm = SSPKm + PKm * PKm
+
+            PKj = n_case * PK -(n_case - 1) * SPKm / n_case
+            SEj = math.sqrt((n_case - 1) * (SSPKm - SPKm * SPKm / n_case) / n_case)
+
+    values = {"SA": SA, "CA": CA, "DA": DA, "TA": TA, "jack_ok": jack_ok, "n_case": n_case, "n": n,
+              "Qc": Qc, "Qd": Qd, "Qtx": Qtx, "Qcdt": Qcdt, "dyx": dyx, "PK": PK,
+              "Qcc": Qcc, "Qdd": Qdd, "Qcd": Qcd, "Term1": Term1, "Term2": Term2, "Term3": Term3,
+              "SE1": SE1, "SE0": SE0, "SPKm": SPKm, "SSPKm": SSPKm, "PKj": PKj, "SEj": SEj}
+    return PKResult(values, m, index, cell_pkm if jack_ok else None, keep_matrices)
+
+
+class PKResult(Mapping):
+    """
+    The result of calculate_pk(), a read-only dict with the same keys as the previous versions.
+
+    Only the variables, the assist matrix SA, CA, DA, TA and the cell of each case are stored.
+    The rows * cols matrix A, S, C, D, T and the PKm series are built from the non-zero cells
+    on the first access and cached, the cache is not pickled.
+
+    Parameters
+    ----------
+    values : a dict.
+        The variables and the assist matrix, see PKResult.FIELDS.
+    m : a dict.
+        The return value of an engine, completed with the cell arrays (see _cells_from_dense()).
+    index : a pandas.Index or None.
+        The index of the cases, None for 0, 1, ..., n_case - 1.
+    cell_pkm : numpy.ndarray or None.
+        The PKm value of each cell, None if jackknife could not be done.
+    keep_matrices : bool.
+        Whether A, S, C, D and T are given or not.
+
+    Examples
+    --------
+    ans["PK"], ans.get("SE1"), ans.PK, list(ans.keys()) and dict(ans) all work as for a dict.
+
+    """
+
+    FIELDS = ("SA", "CA", "DA", "TA", "jack_ok", "n_case", "n", "Qc", "Qd", "Qtx", "Qcdt", "dyx", "PK",
+              "Qcc", "Qdd", "Qcd", "Term1", "Term2", "Term3", "SE1", "SE0", "SPKm", "SSPKm", "PKj", "SEj")
+    MATRICES = ("A", "S", "C", "D", "T")
+
+    __slots__ = FIELDS + ("_shape", "_cells", "_cell", "_cell_pkm", "_levels", "_index", "_cache")
+
+    def __init__(self, values, m, index, cell_pkm, keep_matrices = True):
+        for name in self.FIELDS:
+            setattr(self, name, values[name])
+        self._shape = (m["rows"], m["cols"])
+        self._cells = {name: m[name] for name in ["cell_i", "cell_j", "cell_a", "cell_c", "cell_d", "cell_t"]} if keep_matrices else None
+        self._cell_pkm = cell_pkm
+        self._index = index
+        self._cell = None
+        self._levels = None
+        if "cell" in m:
+            self._cell = m["cell"].astype(np.min_scalar_type(max(len(m["cell_a"]) - 1, 0)))
+        else:
+            self._levels = (m["y_levels"][m["cell_i"]], m["x_levels"][m["cell_j"]], m["cell_a"])
+        self._cache = {}
+
+    def __iter__(self):
+        yield "type"
+        if self._cells is not None:
+            yield from self.MATRICES
+        yield from self.FIELDS[:self.FIELDS.index("SE0") + 1]
+        yield "PKm"
+        if self._levels is not None:
+            yield "PKm_cells"
+        yield from self.FIELDS[self.FIELDS.index("SE0") + 1:]
+
+    def __len__(self):
+        return sum(1 for _ in self.__iter__())
+
+    def __contains__(self, key):
+        return key in tuple(self.__iter__())
+
+    def __getitem__(self, key):
+        if key == "type":
+            return "pk"
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if key not in self:
+            raise KeyError(key)
+        if key not in self._cache:
+            self._cache.update(self._build(key))
+        return self._cache[key]
+
+    def _build(self, key):
+        if key in self.MATRICES:
+            m = dict(self._cells, rows=self._shape[0], cols=self._shape[1])
+            return _dense_from_cells(m)
+        if key == "PKm" and self._cell is None:
+            return {"PKm": None}
+        if key == "PKm":
+            PKms = self.pkm_values()
+            import pandas as pd
+            index = self._index if self._index is not None else pd.RangeIndex(len(PKms))
+            return {"PKm": pd.Series(PKms, index=index, name="PKm")}
+        y, x, count = self._levels
+        PKms = self._cell_pkm if self._cell_pkm is not None else np.full(len(count), np.nan)
+        import pandas as pd
+        return {"PKm_cells": pd.DataFrame({"y": y, "x": x, "n": count, "PKm": PKms})}
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "_cache"}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._cache = {}
+
+    def __repr__(self):
+        return "PKResult(PK=%r, SE0=%r, SE1=%r, n_case=%r)" % (self.PK, self.SE0, self.SE1, self.n_case)
+
+    def to_dict(self):
+        """
+        All the matrix and variables in a plain dict, as calculate_pk() returned in the previous versions.
+        """
+
+        return dict(self)
+
+    def pkm_values(self):
+        """
+        The PKm values case by case as a numpy.ndarray, without building the pandas.Series of ans["PKm"].
+
+        Returns
+        -------
+        PKms : numpy.ndarray or None.
+            The same values as ans["PKm"] (zeros if jackknife could not be done),
+            None if the cell of each case is not kept.
+
+        """
+
+        if self._cell is None:
+            return None
+        if self._cell_pkm is None:
+            return np.zeros(len(self._cell))
+        return self._cell_pkm[self._cell]
 
-    # return the ans.
-    return ans
 
 def print_pk(result, floatfmt=".3f", tablefmt='simple'):
     """
@@ -272,7 +1244,7 @@ def print_pk(result, floatfmt=".3f", tablefmt='simple'):
 
     Parameters
     ----------
-    result : a dict.
+    result : a PKResult or a dict.
         Must be the return value of function calculate_pk().
     floatfmt : string.
         Decimal number formatting.
@@ -291,7 +1263,8 @@ def print_pk(result, floatfmt=".3f", tablefmt='simple'):
 
     """
 
-    if isinstance(result, dict) and result.get("type","unkonwn") == "pk":
+    if isinstance(result, Mapping) and result.get("type","unkonwn") == "pk":
+        import pandas as pd
         df = pd.DataFrame({"PK": result.get("PK"),
                             'SE0': result.get("SE0"),
                             'SE1': result.get("SE1"),
@@ -7,14 +7,15 @@
 """
 
 import math
-import pandas as pd
-from scipy.stats import norm, t
+from collections.abc import Mapping
+import numpy as np
 from pk4adi.utils import print_table
 from pk4adi.pk import calculate_pk
+from pk4adi.profiling import _stage
 
-__all__  = ["compare_pks", "print_pks"]
+__all__  = ["compare_pks", "print_pks", "compare_pks_matrix", "print_pks_matrix"]
 
-def compare_pks(pk1, pk2, auto_print = True):
+def compare_pks(pk1, pk2, auto_print = True, legacy = False):
     """
     Compare two answers of the pk values, which is the output of the function calculate_pk().
         print_pks() will be called before returning ans by default.
@@ -27,6 +28,9 @@ def compare_pks(pk1, pk2, auto_print = True):
         The output of the function calculate_pk().
     auto_print : bool.
         Whether to print the ans before returning it or not.
+    legacy : bool, default value is False.
+        Whether to locate the p value of the t-test by the dichotomy algorithm of
+        the previous versions or not (see T2P()).
 
     Returns
     -------
@@ -50,58 +54,62 @@ def compare_pks(pk1, pk2, auto_print = True):
     ans = {}
     ans.update({"type": "pkc"})
 
-    # check the input type of pk1 and pk2.
-    assert isinstance(pk1, dict) and pk1.get("type", "unknown") == "pk", "pk1 must be the output of the function calculate_pk()."
-    assert isinstance(pk2, dict) and pk2.get("type", "unknown") == "pk", "pk2 must be the output of the function calculate_pk()."
-    assert pk1.get("n_case") == pk2.get("n_case"), "The n_case of pk1 and pk2 must be the same."
-    assert pk1.get("n_case") > 1, "The n_case of pk1 and pk2 must be greater than 1."
-
+    with _stage("compare_pks", "validate"):
+        # check the input type of pk1 and pk2.
+        assert isinstance(pk1, Mapping) and pk1.get("type", "unknown") == "pk", "pk1 must be the output of the function calculate_pk()."
+        assert isinstance(pk2, Mapping) and pk2.get("type", "unknown") == "pk", "pk2 must be the output of the function calculate_pk()."
+        assert pk1.get("n_case") == pk2.get("n_case"), "The n_case of pk1 and pk2 must be the same."
+        assert pk1.get("n_case") > 1, "The n_case of pk1 and pk2 must be greater than 1."
+        assert pk1.get("PKm") is not None and pk2.get("PKm") is not None, "The PKm of pk1 and pk2 must be kept case by case."
 
     n_case = pk1.get("n_case")
     ans.update({"n_case": n_case})
 
-    # calculate the p value using scipy.norm.
-    PKD = pk1.get("PKj") - pk2.get("PKj")
-    SED = math.sqrt(pk1.get("SEj") * pk1.get("SEj") + pk2.get("SEj") * pk2.get("SEj"))
-    ZD = PKD / SED
-    ZP, ZJ = Z2P(ZD)
-
-    # save the variables.
-    ans.update({"PKD": PKD})
-    ans.update({"SED": SED})
-    ans.update({"ZD": ZD})
-    ans.update({"ZP": ZP})
-    ans.update({"ZJ": ZJ})
-
-    # calculate the p value using scipy.t.
-    PKmD = pk1.get("PKm") - pk2.get("PKm")
-    SumD = 0
-    SSD = 0
-    for i in range(n_case):
-        current = PKmD[i]
-        SumD = SumD + current
-        SSD = SSD + current * current
-
-    DF = n_case - 1
-    PKDJ = n_case * PKD - DF / n_case * SumD
-    SEDJ = math.sqrt( DF / n_case * ( SSD - 1 / n_case * SumD * SumD ))
-    TD = float(PKDJ) / float(SEDJ)
-    TP, TJ = T2P(TD, DF)
-
-    # save the variables.
-    ans.update({"PKmD": PKmD})
-    ans.update({"SumD": SumD})
-    ans.update({"SSD": SSD})
-    ans.update({"DF": DF})
-    ans.update({"PKDJ": PKDJ})
-    ans.update({"SEDJ": SEDJ})
-    ans.update({"TD": TD})
-    ans.update({"TP": TP})
-    ans.update({"TJ": TJ})
+    with _stage("compare_pks", "z-test"):
+        # calculate the p value using scipy.norm.
+        PKD = pk1.get("PKj") - pk2.get("PKj")
+        SED = math.sqrt(pk1.get("SEj") * pk1.get("SEj") + pk2.get("SEj") * pk2.get("SEj"))
+        ZD = PKD / SED
+        ZP, ZJ = Z2P(ZD)
+
+        # save the variables.
+        ans.update({"PKD": PKD})
+        ans.update({"SED": SED})
+        ans.update({"ZD": ZD})
+        ans.update({"ZP": ZP})
+        ans.update({"ZJ": ZJ})
+
+    with _stage("compare_pks", "t-test"):
+        # calculate the p value using scipy.t.
+        PKmD = pk1.get("PKm") - pk2.get("PKm")
+        SumD = 0
+        SSD = 0
+        for i in range(n_case):
+            current = PKmD[i]
+            SumD = SumD + current
+            SSD = SSD + current * current
+
+        DF = n_case - 1
+        PKDJ = n_case * PKD - DF / n_case * SumD
+        SEDJ = math.sqrt( DF / n_case * ( SSD - 1 / n_case * SumD * SumD ))
+        TD = float(PKDJ) / float(SEDJ)
+        TP, TJ = T2P(TD, DF, legacy=legacy)
+
+        # save the variables.
+        ans.update({"PKmD": PKmD})
+        ans.update({"SumD": SumD})
+        ans.update({"SSD": SSD})
+        ans.update({"DF": DF})
+        ans.update({"PKDJ": PKDJ})
+        ans.update({"SEDJ": SEDJ})
+        ans.update({"TD": TD})
+        ans.update({"TP": TP})
+        ans.update({"TJ": TJ})
 
     # format and print.
     if auto_print:
-        print_pks(ans)
+        with _stage("compare_pks", "print"):
+            print_pks(ans)
 
     # return the ans.
     return ans
@@ -133,6 +141,7 @@ def print_pks(result, floatfmt=".3f", tablefmt='simple'):
     """
 
     if isinstance(result, dict) and result.get("type", "unkonwn") == "pkc":
+        import pandas as pd
         df1 = pd.DataFrame({"PKD": result.get("PKD"),
                             'SED': result.get("SED"),
                             'ZD': result.get("ZD"),
@@ -154,20 +163,148 @@ def print_pks(result, floatfmt=".3f", tablefmt='simple'):
         print_table(df2, floatfmt, tablefmt)
 
 
+def compare_pks_matrix(pks, names = None, auto_print = True, legacy = False):
+    """
+    Compare all the pairs of many answers of the pk values at once.
+        print_pks_matrix() will be called before returning ans by default.
+
+    Parameters
+    ----------
+    pks : a list of dicts.
+        The outputs of the function calculate_pk(), which must share the same n_case.
+    names : a list or None.
+        The names of the indicators, used as the index and columns of the matrix.
+        None for 0, 1, ..., k - 1.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+    legacy : bool, default value is False.
+        Whether to locate the p value of the t-test by the dichotomy algorithm of
+        the previous versions or not (see T2P()).
+
+    Returns
+    -------
+    ans : a dict.
+        Besides n_case and DF, the k * k pandas.DataFrame PKD, SED, ZD, ZP, PKDJ, SEDJ, TD
+        and TP, where the item at (i, j) is the same as the variable of the same name
+        returned by compare_pks(pks[i], pks[j]). The diagonal is left as nan.
+
+    Notes
+    -----
+    The PKm series are stacked into one k * n array once, then SumD and SSD of all the
+    pairs are given by the row sums and the Gram matrix of the centered array.
+
+    """
+
+    # check the input type of pks.
+    assert len(pks) >= 2, "pks should contain at least two outputs of the function calculate_pk()."
+    for pk in pks:
+        assert isinstance(pk, Mapping) and pk.get("type", "unknown") == "pk", "pks must be the outputs of the function calculate_pk()."
+        assert pk.get("n_case") == pks[0].get("n_case"), "The n_case of all the pks must be the same."
+    assert pks[0].get("n_case") > 1, "The n_case of pks must be greater than 1."
+    assert all(pk.get("PKm") is not None for pk in pks), "The PKm of pks must be kept case by case."
+    if names is None:
+        names = list(range(len(pks)))
+    assert len(names) == len(pks), "names and pks should have the same length."
+
+    n_case = pks[0].get("n_case")
+    DF = n_case - 1
+    PKj = np.array([pk.get("PKj") for pk in pks], dtype=float)
+    SEj = np.array([pk.get("SEj") for pk in pks], dtype=float)
+
+    # stack the PKm series, then center each of them to keep the Gram matrix accurate.
+    PKm = np.vstack([np.asarray(pk.get("PKm"), dtype=float) for pk in pks])
+    Sum = np.array([math.fsum(row) for row in PKm])
+    centered = PKm - (Sum / n_case)[:, None]
+    G = centered @ centered.T
+    g = np.diag(G)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # calculate the p value using scipy.norm.
+        PKD = PKj[:, None] - PKj[None, :]
+        SED = np.sqrt(SEj[:, None] ** 2 + SEj[None, :] ** 2)
+        ZD = PKD / SED
+        ZP = Z2P(ZD)[0]
+
+        # calculate the p value using scipy.t.
+        SumD = Sum[:, None] - Sum[None, :]
+        VarD = np.maximum(g[:, None] + g[None, :] - 2 * G, 0)
+        SSD = VarD + SumD * SumD / n_case
+        PKDJ = n_case * PKD - DF / n_case * SumD
+        SEDJ = np.sqrt(DF / n_case * VarD)
+        TD = PKDJ / SEDJ
+        if legacy:
+            TP = np.full(TD.shape, np.nan)
+            for i, j in zip(*np.nonzero(np.isfinite(TD))):
+                TP[i, j] = T2P(TD[i, j], DF, legacy=True)[0]
+        else:
+            TP = T2P(TD, DF)[0]
+
+    import pandas as pd
+    ans = {}
+    ans.update({"type": "pkcm"})
+    ans.update({"n_case": n_case})
+    ans.update({"DF": DF})
+    for key, value in [("PKD", PKD), ("SED", SED), ("ZD", ZD), ("ZP", ZP), ("SumD", SumD), ("SSD", SSD),
+                       ("PKDJ", PKDJ), ("SEDJ", SEDJ), ("TD", TD), ("TP", TP)]:
+        value = value.copy()
+        np.fill_diagonal(value, np.nan)
+        ans.update({key: pd.DataFrame(value, index=names, columns=names)})
+
+    # format and print.
+    if auto_print:
+        print_pks_matrix(ans)
+
+    # return the ans.
+    return ans
+
+
+def print_pks_matrix(result, floatfmt=".3f", tablefmt='simple'):
+    """
+    Pretty display of the pairwise comparison matrix of many pk calculation results.
+
+    Parameters
+    ----------
+    result : a dict.
+        Must be the return value of function compare_pks_matrix().
+    floatfmt : string.
+        Decimal number formatting.
+    tablefmt : string.
+        Table format (e.g. 'simple', 'plain', 'html', 'latex', 'grid', 'rst').
+        For a full list of available formats, please refer to
+        https://pypi.org/project/tabulate/
+
+    Returns
+    -------
+    Nothing will be returned.
+
+    Notes
+    -----
+    To be added.
+
+    """
+
+    if isinstance(result, dict) and result.get("type", "unkonwn") == "pkcm":
+        print('=====================\nPKs comparison matrix\n=====================\n')
+        for key, title in [("PKD", "PKD (z-test)"), ("ZP", "P value (z-test)"),
+                           ("PKDJ", "PKDJ (t-test)"), ("TP", "P value (t-test)")]:
+            print('%s\n%s\n%s\n' % ('=' * len(title), title, '=' * len(title)))
+            print_table(result.get(key).rename_axis("indicator").reset_index().astype({"indicator": str}), floatfmt, tablefmt)
+
+
 def Z2P(target):
     """
     Query the p value matching the output of pks comparison using scipy.norm.
 
     Parameters
     ----------
-    target : float.
+    target : float or numpy.ndarray.
         Must be ZD in the return dict of function compare_pks().
 
     Returns
     -------
-    p: float.
+    p: float or numpy.ndarray.
         The p value.
-    comment: string.
+    comment: string or numpy.ndarray.
         The interval of the returned p value.
 
     Notes
@@ -176,30 +313,37 @@ def Z2P(target):
 
     """
 
-    value = abs(target)
+    from scipy.stats import norm
+
+    value = np.abs(target)
     auc = norm.cdf(value) - 0.5
     p = 1 - 2 * auc
     return p, judgeP(p)
 
 
-def T2P(target, df, verbose = False):
+def T2P(target, df, verbose = False, legacy = False):
     """
     Query the p value matching the output of pks comparison using scipy.t.
 
     Parameters
     ----------
-    target : float.
+    target : float or numpy.ndarray.
         Must be TD in the return dict of function compare_pks().
-    df : int.
+    df : int or numpy.ndarray.
         The degrees of freedom.
     verbose : bool, default value is False.
         Choose whether print the intermediate output of locating the p value using the dichotomy algorithm.
+    legacy : bool, default value is False.
+        If False, the exact two-sided p value is given by one call of t.sf(), which also
+        accepts arrays of target and df.
+        If True, the one-sided p value is located by the dichotomy algorithm on t.ppf()
+        and clipped into [0.00001, 0.5] as the previous versions did, only for a float target.
 
     Returns
     -------
-    p: float.
+    p: float or numpy.ndarray.
         The p value.
-    comment: string.
+    comment: string or numpy.ndarray.
         The interval of the returned p value.
 
     Notes
@@ -208,6 +352,16 @@ def T2P(target, df, verbose = False):
 
     """
 
+    from scipy.stats import t
+
+    if not legacy:
+        p = 2 * t.sf(np.abs(target), df)
+        if np.ndim(p) == 0:
+            p = float(p)
+            if verbose:
+                print("The two-sided p value for df at %3d and t at %.4f is %.5f." % (df, abs(target), p))
+        return p, judgeP(p)
+
     value = abs(target)
     left = 0.5
     right = 0.00001
@@ -259,12 +413,12 @@ def judgeP(p):
 
     Parameters
     ----------
-    p: float.
+    p: float or numpy.ndarray.
         The p value.
 
     Returns
     -------
-    comment: string.
+    comment: string or numpy.ndarray.
         The interval of the returned p value.
 
     Notes
@@ -273,6 +427,10 @@ def judgeP(p):
 
     """
 
+    if np.ndim(p) > 0:
+        p = np.asarray(p)
+        return np.select([p > 0.05, p > 0.01, p > 0.001], ["P > 0.05", "P > 0.01", "P > 0.001"], "P < 0.001")
+
     if p > 0.05:
         return "P > 0.05"
     elif p > 0.01:
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   pooled.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import io
+import math
+import numpy as np
+from pk4adi.pk import print_pk, _check_array, _cell_tables, _exact_sum, _jackknife_cells, _jackknife_sums, _pk_ans
+from pk4adi.chunked import _PairCounter, _CHUNKED_ENGINES
+
+__all__ = ["PKStats"]
+
+
+class PKStats(object):
+    """
+    The sufficient statistics of the pk value, mergeable across sites, workers or chunks.
+
+    The statistics of a stratum, such as a site of a multi-centre trial, are the counts of its
+    distinct (x, y) pairs, so their size only depends on the categories of x and y. They are
+    computed where the data is, serialized by to_bytes() or to_dict(), and merged by merge().
+    The pooled pk value is either stratified, only pairing the cases within each stratum,
+    or computed from the merged contingency table, the same as calculate_pk() of all the cases.
+
+    Parameters
+    ----------
+    x_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or None, default value is None.
+        Indicator, None for empty statistics.
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or None, default value is None.
+        State.
+    stratum : string, default value is "all".
+        The name of the stratum the cases belong to.
+    validate : bool, default value is True.
+        Whether to check that x and y only contain numbers without nan or not.
+
+    Examples
+    --------
+    # at each site.
+    data = PKStats(x, y, stratum="site A").to_bytes()
+
+    # at the centre, or as the reduce step of a map-reduce pipeline.
+    stats = functools.reduce(PKStats.merge, [PKStats.from_bytes(data) for data in received])
+    stats.calculate_pk(stratified=True)
+    stats.calculate_pk(stratified=False)
+
+    """
+
+    def __init__(self, x_in = None, y_in = None, stratum = "all", validate = True):
+        self._strata = {}
+        if x_in is not None or y_in is not None:
+            self.update(x_in, y_in, stratum, validate)
+
+    def update(self, x_in, y_in, stratum = "all", validate = True):
+        """
+        Add the cases to a stratum, created if it is new.
+
+        Parameters
+        ----------
+        x_in, y_in, stratum, validate :
+            See PKStats.
+
+        Returns
+        -------
+        self : a PKStats.
+
+        """
+
+        x = _check_array(x_in, "x", validate)
+        y = _check_array(y_in, "y", validate)
+        assert len(x) == len(y), "x and y should contain the same cases."
+        self._counter(stratum).add(x, y)
+        return self
+
+    @classmethod
+    def from_table(cls, A, x_levels = None, y_levels = None, stratum = "all"):
+        """
+        The statistics of a stratum given by its count matrix, such as a crosstab.
+
+        Parameters
+        ----------
+        A, x_levels, y_levels :
+            See calculate_pk_from_table().
+        stratum : string, default value is "all".
+            The name of the stratum.
+
+        Returns
+        -------
+        stats : a PKStats.
+
+        """
+
+        import pandas as pd
+
+        if isinstance(A, pd.DataFrame):
+            x_levels = A.columns.to_numpy() if x_levels is None else x_levels
+            y_levels = A.index.to_numpy() if y_levels is None else y_levels
+            A = A.to_numpy()
+        A = np.asarray(A)
+        assert A.ndim == 2, "A should be 2-D."
+        assert A.dtype.kind in "biuf" and np.isfinite(A).all(), "A should not contain any non-num or nan."
+        assert (A >= 0).all() and (A == np.floor(A)).all(), "A should only contain non-negative integer counts."
+        x_levels = np.arange(A.shape[1]) if x_levels is None else _check_array(x_levels, "x_levels")
+        y_levels = np.arange(A.shape[0]) if y_levels is None else _check_array(y_levels, "y_levels")
+        assert len(x_levels) == A.shape[1] and len(y_levels) == A.shape[0], "x_levels and y_levels should match the shape of A."
+
+        stats = cls()
+        cell_i, cell_j = np.nonzero(A)
+        stats._counter(stratum).add(x_levels[cell_j], y_levels[cell_i], A[cell_i, cell_j].astype(np.int64))
+        return stats
+
+    @property
+    def strata(self):
+        """
+        The names of the strata.
+        """
+
+        return list(self._strata)
+
+    @property
+    def n_case(self):
+        """
+        The case num of all the strata.
+        """
+
+        return sum(int(counter.counts.sum()) for counter in self._strata.values() if counter.counts is not None)
+
+    def __len__(self):
+        return len(self._strata)
+
+    def __repr__(self):
+        return "PKStats(strata=%r, n_case=%r)" % (self.strata, self.n_case)
+
+    def merge(self, *others):
+        """
+        Merge the statistics into new statistics.
+
+        The strata of the same name are merged by adding up their counts, as the partial results of
+        the same site computed by different workers, and the other strata are kept side by side.
+        It takes a time proportional to the distinct (x, y) pairs, not to the cases.
+
+        Parameters
+        ----------
+        others : PKStats.
+            The statistics merged with this one.
+
+        Returns
+        -------
+        stats : a PKStats.
+
+        """
+
+        stats = PKStats()
+        for source in (self,) + others:
+            assert isinstance(source, PKStats), "Only PKStats could be merged."
+            for name, counter in source._strata.items():
+                if counter.xs is not None:
+                    stats._counter(name).add(counter.xs, counter.ys, counter.counts)
+        return stats
+
+    def calculate_pk(self, stratified = True, auto_print = True, method = "sparse", keep_matrices = False):
+        """
+        Compute the pooled pk value of all the strata.
+
+        Parameters
+        ----------
+        stratified : bool, default value is True.
+            Whether to only pair the cases within each stratum or not. If False, the strata are
+            merged into one contingency table, the same as calculate_pk() of all the cases.
+        auto_print : bool.
+            Whether to print the ans before returning it or not.
+        method : string, default value is "sparse".
+            The engine used for one table, "numpy" or "sparse" (see calculate_pk()).
+        keep_matrices : bool, default value is False.
+            Whether to save the rows * cols matrix in the ans or not, for one table.
+
+        Returns
+        -------
+        ans : a dict.
+            For one table (stratified = False or a single stratum), the same as the return value of
+            calculate_pk_from_table(). Otherwise the variables of calculate_pk() summed over the strata,
+            n_strata and PK_strata (the pk value of each stratum), with PKm None.
+
+        Notes
+        -----
+        The stratified PK is (Qc + Qtx / 2) / Qcdt with the pair counts summed over the strata.
+        SE1 sums the terms of each case (E - dyx * (n - ni)) ** 2 within its stratum, and SE0 sums the
+        centered Term1 of each stratum. The jackknife removes one case from its stratum at a time.
+
+        """
+
+        assert method in _CHUNKED_ENGINES, "method should be one of %s." % ", ".join(_CHUNKED_ENGINES)
+        counters = [counter for counter in self._strata.values() if counter.xs is not None]
+        assert len(counters) > 0, "There should be at least two cases."
+
+        if not stratified or len(counters) == 1:
+            merged = _PairCounter()
+            for counter in counters:
+                merged.add(counter.xs, counter.ys, counter.counts)
+            ans = _pk_ans(merged.tables(method), None, method, keep_matrices)
+        else:
+            ans = _stratified_ans({name: _stratum_sums(counter) for name, counter in self._strata.items() if counter.xs is not None})
+
+        # format and print.
+        if auto_print:
+            print_pk(ans)
+
+        return ans
+
+    def to_dict(self):
+        """
+        The counts of each stratum in a JSON serializable dict, read back by PKStats.from_dict().
+        """
+
+        return {"strata": {name: {"x": counter.xs.tolist(), "y": counter.ys.tolist(), "n": counter.counts.tolist()}
+                           for name, counter in self._strata.items() if counter.xs is not None}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        The statistics of a dict given by PKStats.to_dict().
+        """
+
+        stats = cls()
+        for name, counts in data["strata"].items():
+            stats._counter(name).add(np.asarray(counts["x"]), np.asarray(counts["y"]), np.asarray(counts["n"], dtype=np.int64))
+        return stats
+
+    def to_bytes(self):
+        """
+        The counts of each stratum as compressed .npz bytes, read back by PKStats.from_bytes().
+        """
+
+        arrays = {"names": np.array([str(name) for name in self._strata], dtype=str)}
+        for k, counter in enumerate(self._strata.values()):
+            if counter.xs is not None:
+                arrays.update({"x_%d" % k: counter.xs, "y_%d" % k: counter.ys, "n_%d" % k: counter.counts})
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        The statistics of the bytes given by PKStats.to_bytes().
+        """
+
+        stats = cls()
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            for k, name in enumerate(arrays["names"]):
+                counter = stats._counter(str(name))
+                if "x_%d" % k in arrays:
+                    counter.add(arrays["x_%d" % k], arrays["y_%d" % k], arrays["n_%d" % k])
+        return stats
+
+    def _counter(self, stratum):
+        if stratum not in self._strata:
+            self._strata[stratum] = _PairCounter()
+        return self._strata[stratum]
+
+
+def _stratum_sums(counter):
+    """
+    The pair counts, the terms of SE0 and SE1 and the cell values of a stratum.
+
+    Returns
+    -------
+    sums : a dict.
+        n, Qc, Qd, Qtx, Term1, R2 (the sum over the rows of (n - ni) * (Qci - Qdi)),
+        R3 (the sum over the rows of ni * (n - ni) * (n - ni)) as Python ints,
+        and cell_a, cell_c, cell_d, cell_t.
+
+    """
+
+    y_values, cell_i = np.unique(counter.ys, return_inverse=True)
+    x_values, cell_j = np.unique(counter.xs, return_inverse=True)
+    cell_a = counter.counts.astype(np.int64)
+    n = int(cell_a.sum())
+
+    # a stratum holding a single state adds no pair, its cases only count in the jackknife.
+    if len(y_values) < 2:
+        zeros = np.zeros(len(cell_a), dtype=np.int64)
+        return {"n": n, "Qc": 0, "Qd": 0, "Qtx": 0, "Term1": 0, "R2": 0, "R3": 0,
+                "cell_a": cell_a, "cell_c": zeros, "cell_d": zeros, "cell_t": zeros}
+
+    m = _cell_tables(len(y_values), len(x_values), cell_i.reshape(-1), cell_j.reshape(-1), cell_a)
+    CA, DA, TA = m["CA"], m["DA"], m["TA"]
+    ni = m["ni"].astype(np.int64)
+    rest = n - ni
+    return {"n": n, "Qc": int(CA[0, 1]), "Qd": int(DA[0, 1]), "Qtx": int(TA[0, 1]),
+            "Term1": int(CA[1, 1]) - 2 * int(TA[1, 1]) + int(DA[1, 1]),
+            "R2": _exact_sum(np.ones_like(rest), (CA[:, 0] - DA[:, 0]).astype(np.int64), rest),
+            "R3": _exact_sum(ni, rest, rest),
+            "cell_a": cell_a, "cell_c": m["cell_c"], "cell_d": m["cell_d"], "cell_t": m["cell_t"]}
+
+
+def _stratified_ans(strata):
+    """
+    The stratified pk value, the SEs and the jackknife from the sums of each stratum, see _stratum_sums().
+    """
+
+    n_case = sum(s["n"] for s in strata.values())
+    Qc = sum(s["Qc"] for s in strata.values())
+    Qd = sum(s["Qd"] for s in strata.values())
+    Qtx = sum(s["Qtx"] for s in strata.values())
+    Qcdt = Qc + Qd + Qtx
+    assert Qcdt > 0, "At least one stratum should hold two distinct values of y."
+
+    dyx = (Qc - Qd) / Qcdt
+    PK = (dyx + 1) / 2
+    Term1 = sum(s["Term1"] for s in strata.values())
+    Term2 = -2 * dyx * sum(s["R2"] for s in strata.values())
+    Term3 = dyx * dyx * sum(s["R3"] for s in strata.values())
+    SE1 = math.sqrt(Term1 + Term2 + Term3) / Qcdt
+    SE0 = math.sqrt(math.fsum((s["Term1"] * s["n"] - (s["Qc"] - s["Qd"]) ** 2) / s["n"] for s in strata.values())) / Qcdt
+
+    # remove one case from its stratum, PKm only depends on the cell it is located in.
+    cell_a = np.concatenate([s["cell_a"] for s in strata.values()])
+    cell_c = np.concatenate([s["cell_c"] for s in strata.values()])
+    cell_d = np.concatenate([s["cell_d"] for s in strata.values()])
+    cell_t = np.concatenate([s["cell_t"] for s in strata.values()])
+    jack_ok = bool((Qcdt - 2 * (cell_c + cell_d + cell_t) > 0).all())
+    SPKm, SSPKm, PKj, SEj = np.nan, np.nan, np.nan, np.nan
+    if jack_ok:
+        cell_pkm = _jackknife_cells(Qc, Qd, Qtx, cell_c, cell_d, cell_t)
+        SPKm, SSPKm, PKj, SEj = _jackknife_sums(n_case, PK, cell_a, cell_pkm)
+
+    PK_strata = {name: ((s["Qc"] - s["Qd"]) / (s["Qc"] + s["Qd"] + s["Qtx"]) + 1) / 2 if s["Qc"] + s["Qd"] + s["Qtx"] > 0 else np.nan
+                 for name, s in strata.items()}
+    return {"type": "pk", "n_strata": len(strata), "jack_ok": jack_ok, "n_case": n_case, "n": n_case,
+            "Qc": Qc, "Qd": Qd, "Qtx": Qtx, "Qcdt": Qcdt, "dyx": dyx, "PK": PK,
+            "Term1": Term1, "Term2": Term2, "Term3": Term3, "SE1": SE1, "SE0": SE0, "PKm": None,
+            "SPKm": SPKm, "SSPKm": SSPKm, "PKj": PKj, "SEj": SEj, "PK_strata": PK_strata}
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   profiling.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import json
+import time
+import contextlib
+import contextvars
+import tracemalloc
+
+__all__ = ["PKProfiler"]
+
+# the profilers entered in the current thread or task, innermost last.
+_ACTIVE = contextvars.ContextVar("pk4adi_profilers", default=())
+_NULL = contextlib.nullcontext()
+
+
+class PKProfiler(object):
+    """
+    Record the wall time and the allocated memory of each stage of calculate_pk() and compare_pks().
+
+    The stages of calculate_pk() are validate, categorize (the categories of y and x),
+    tables (the matrix A, S, C, D, T and the assist matrix), variance (the Q terms and the SEs),
+    jackknife and print. Those of compare_pks() are validate, z-test, t-test and print.
+    Nothing is recorded out of the with block, where each stage only costs a look up.
+
+    Parameters
+    ----------
+    memory : bool, default value is False.
+        Whether to record the peak memory allocated in each stage by tracemalloc or not,
+        which slows the numpy operations down. tracemalloc is started and stopped with the
+        profiler if it was not tracing yet.
+    callback : a function or None, default value is None.
+        Called with the record dict of each stage once it ends, such as to send it to a monitoring system.
+
+    Examples
+    --------
+    with PKProfiler(memory=True) as profiler:
+        pk1 = calculate_pk(x1, y, auto_print=False)
+        pk2 = calculate_pk(x2, y, auto_print=False)
+        compare_pks(pk1, pk2)
+    profiler.report()
+    profiler.to_json("profile.json")
+
+    """
+
+    def __init__(self, memory = False, callback = None):
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self._token = None
+        self._own_tracing = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+        self._token = _ACTIVE.set(_ACTIVE.get() + (self,))
+        return self
+
+    def __exit__(self, *exc):
+        _ACTIVE.reset(self._token)
+        self._token = None
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+        return False
+
+    def summary(self):
+        """
+        The records summed by function and stage.
+
+        Returns
+        -------
+        stages : a list of dicts.
+            function, stage, calls, seconds (the total wall time) and memory
+            (the max peak bytes of a call, None if memory is False), in the order of the first call.
+
+        """
+
+        stages = {}
+        for record in self.records:
+            key = (record["function"], record["stage"])
+            if key not in stages:
+                stages[key] = {"function": key[0], "stage": key[1], "calls": 0, "seconds": 0.0, "memory": None}
+            stage = stages[key]
+            stage["calls"] += 1
+            stage["seconds"] += record["seconds"]
+            if record["memory"] is not None:
+                stage["memory"] = max(stage["memory"] or 0, record["memory"])
+        return list(stages.values())
+
+    def to_dict(self):
+        """
+        The summary and all the records in a dict, see summary().
+        """
+
+        return {"stages": self.summary(), "records": list(self.records)}
+
+    def to_json(self, path = None, **kwargs):
+        """
+        The dict of to_dict() as a JSON string, also written to path if given.
+        """
+
+        text = json.dumps(self.to_dict(), **kwargs)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def report(self, floatfmt=".6f", tablefmt='simple'):
+        """
+        Pretty display of the summary.
+        """
+
+        import pandas as pd
+        from pk4adi.utils import print_table
+
+        print('===============\nPK profile\n===============\n')
+        print_table(pd.DataFrame(self.summary(), columns=["function", "stage", "calls", "seconds", "memory"]), floatfmt, tablefmt)
+
+    def reset(self):
+        """
+        Drop all the records.
+        """
+
+        self.records = []
+
+    def _add(self, record):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+
+class _Stage(object):
+    """
+    The timer of a stage, shared by all the active profilers.
+    """
+
+    __slots__ = ("profilers", "function", "stage", "start", "memory", "traced")
+
+    def __init__(self, profilers, function, stage):
+        self.profilers = profilers
+        self.function = function
+        self.stage = stage
+        self.memory = any(profiler.memory for profiler in profilers) and tracemalloc.is_tracing()
+
+    def __enter__(self):
+        if self.memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self.traced = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        memory = tracemalloc.get_traced_memory()[1] - self.traced if self.memory else None
+        for profiler in self.profilers:
+            profiler._add({"function": self.function, "stage": self.stage, "seconds": seconds,
+                           "memory": memory if profiler.memory else None})
+        return False
+
+
+def _stage(function, stage):
+    """
+    A context manager timing a stage of function for the active profilers, a shared no-op without profiler.
+    """
+
+    profilers = _ACTIVE.get()
+    if not profilers:
+        return _NULL
+    return _Stage(profilers, function, stage)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   resample.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import math
+import numpy as np
+import pandas as pd
+from scipy.stats import beta, norm, rankdata
+from pk4adi.utils import print_table
+from pk4adi.pk import _check_xy, _factorize_y, _numpy_engine, _pk_ans, _jackknife_cells, _pk_of_tables
+from pk4adi.pkc import judgeP
+from pk4adi.parallel import _run
+
+__all__ = ["bootstrap_pk", "print_bootstrap_pk", "permutation_compare_pks", "print_permutation_compare_pks"]
+
+_CHUNK_ITEMS = 2 ** 22
+
+
+def bootstrap_pk(x_in, y_in, n_boot = 2000, seed = None, ci = "percentile", level = 0.95,
+                 chunk_size = 256, max_workers = 1, auto_print = True):
+    """
+    Compute the bootstrap confidence interval of the pk value.
+        print_bootstrap_pk() will be called before returning ans by default.
+
+    Parameters
+    ----------
+    x_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        Indicator.
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        State.
+    n_boot : int, default value is 2000.
+        The num of bootstrap resamples.
+    seed : int or None.
+        The seed of the random generator, the same seed gives the same ans whatever
+        the max_workers is.
+    ci : string, default value is "percentile".
+        "percentile" for the percentile interval, "bca" for the bias-corrected and
+        accelerated interval, whose acceleration comes from the jackknife PKm values.
+        "bca" falls back to "percentile" if the jackknife could not be done or all the
+        resamples lie on one side of PK.
+    level : float, default value is 0.95.
+        The confidence level.
+    chunk_size : int, default value is 256.
+        The num of resamples computed at once in one array.
+    max_workers : int or None, default value is 1.
+        The process num used to compute the chunks, 1 to compute them in this process.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+
+    Returns
+    -------
+    ans : a dict.
+        PK, n_boot, ci, level, the bootstrap resamples PKb, the num of valid resamples n_valid
+        (those holding at least two states), their standard error SEb, bias, the
+        interval [low, high] and the kind of interval actually computed ci_used.
+
+    Notes
+    -----
+    A resample of the cases with replacement only changes the case num of each non-zero cell
+    of the matrix A, so each resample is drawn as a multinomial count over the cells and the
+    pk values of a whole chunk of resampled matrix are computed at once.
+
+    """
+
+    assert ci in ("percentile", "bca"), "ci should be percentile or bca."
+    assert 0 < level < 1, "level should be in (0, 1)."
+    assert n_boot >= 1 and chunk_size >= 1, "n_boot and chunk_size should be positive."
+
+    x, y, index = _check_xy(x_in, y_in)
+    m = _numpy_engine(x, y)
+    pk = _pk_ans(m, index, keep_matrices=False)
+    n_case = pk["n_case"]
+    cells = (m["rows"], m["cols"], m["cell_i"], m["cell_j"], m["cell_a"])
+
+    # each chunk has its own random stream spawned from the seed, and holds at most
+    # _CHUNK_ITEMS items of resampled matrix.
+    chunk_size = max(1, min(chunk_size, _CHUNK_ITEMS // (m["rows"] * m["cols"])))
+    sizes = [min(chunk_size, n_boot - k) for k in range(0, n_boot, chunk_size)]
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(cells, n_case, size, stream) for size, stream in zip(sizes, streams)]
+    if max_workers == 1:
+        PKb = np.concatenate([_bootstrap_chunk(*task) for task in tasks])
+    else:
+        PKb = np.array(_run(_bootstrap_chunk, tasks, max_workers))
+
+    valid = PKb[np.isfinite(PKb)]
+    alpha = (1 - level) / 2
+    quantiles = [alpha, 1 - alpha]
+    ci_used = "percentile"
+    if ci == "bca" and len(valid) > 0:
+        # bias correction from the resamples, acceleration from the jackknife.
+        # the percentile interval is kept if the jackknife could not be done (jack_ok is False)
+        # or all the resamples lie on one side of PK (z0 is infinite).
+        z0 = norm.ppf((np.sum(valid < pk["PK"]) + 0.5 * np.sum(valid == pk["PK"])) / len(valid))
+        if pk["jack_ok"] and np.isfinite(z0):
+            cell_pkm = _jackknife_cells(pk["Qc"], pk["Qd"], pk["Qtx"], m["cell_c"], m["cell_d"], m["cell_t"])
+            d = np.sum(m["cell_a"] * cell_pkm) / n_case - cell_pkm
+            denominator = 6 * math.fsum(m["cell_a"] * d ** 2) ** 1.5
+            # all the jackknife pk values are the same (such as PK = 1), no acceleration.
+            acc = math.fsum(m["cell_a"] * d ** 3) / denominator if denominator > 0 else 0.0
+            z = norm.ppf([alpha, 1 - alpha])
+            quantiles = norm.cdf(z0 + (z0 + z) / (1 - acc * (z0 + z)))
+            ci_used = "bca"
+
+    low, high = np.quantile(valid, quantiles) if len(valid) else (np.nan, np.nan)
+
+    ans = {}
+    ans.update({"type": "pkb"})
+    ans.update({"n_case": n_case})
+    ans.update({"PK": pk["PK"]})
+    ans.update({"n_boot": n_boot})
+    ans.update({"ci": ci})
+    ans.update({"ci_used": ci_used})
+    ans.update({"level": level})
+    ans.update({"PKb": PKb})
+    ans.update({"n_valid": len(valid)})
+    ans.update({"SEb": np.std(valid, ddof=1) if len(valid) > 1 else np.nan})
+    ans.update({"bias": np.mean(valid) - pk["PK"] if len(valid) else np.nan})
+    ans.update({"low": float(low)})
+    ans.update({"high": float(high)})
+
+    # format and print.
+    if auto_print:
+        print_bootstrap_pk(ans)
+
+    # return the ans.
+    return ans
+
+
+def print_bootstrap_pk(result, floatfmt=".3f", tablefmt='simple'):
+    """
+    Pretty display of a pk bootstrap result.
+
+    Parameters
+    ----------
+    result : a dict.
+        Must be the return value of function bootstrap_pk().
+    floatfmt : string.
+        Decimal number formatting.
+    tablefmt : string.
+        Table format (e.g. 'simple', 'plain', 'html', 'latex', 'grid', 'rst').
+        For a full list of available formats, please refer to
+        https://pypi.org/project/tabulate/
+
+    Returns
+    -------
+    Nothing will be returned.
+
+    Notes
+    -----
+    To be added.
+
+    """
+
+    if isinstance(result, dict) and result.get("type", "unkonwn") == "pkb":
+        df = pd.DataFrame({"PK": result.get("PK"),
+                           'SEb': result.get("SEb"),
+                           'bias': result.get("bias"),
+                           'CI': "%s %.0f%%" % (result.get("ci_used", result.get("ci")), 100 * result.get("level")),
+                           'low': result.get("low"),
+                           'high': result.get("high"),
+                           'n_valid': result.get("n_valid")},
+                          index=[0])
+        print('============\nPK bootstrap\n============\n')
+        print_table(df, floatfmt, tablefmt)
+
+
+def permutation_compare_pks(x1_in, x2_in, y_in, n_perm = 10000, seed = None, alpha = 0.05,
+                            early_stop = True, batch_size = 1000, auto_print = True):
+    """
+    Compare the pk values of two indicators of the same cases with a paired permutation test.
+        print_permutation_compare_pks() will be called before returning ans by default.
+
+    Parameters
+    ----------
+    x1_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        The first indicator.
+    x2_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        The second indicator.
+    y_in : a list, a pandas series (pandas.Series()), a 1-D numpy.ndarray or any 1-D buffer.
+        State.
+    n_perm : int, default value is 10000.
+        The max num of permutations. If 2 ** n_case is not greater than n_perm, all the
+        permutations are enumerated and the exact p value is given.
+    seed : int or None.
+        The seed of the random generator.
+    alpha : float, default value is 0.05.
+        The significance level used by the early stopping.
+    early_stop : bool, default value is True.
+        Whether to stop the Monte-Carlo permutations once the 99% Clopper-Pearson interval
+        of the p value lies entirely above or below alpha.
+    batch_size : int, default value is 1000.
+        The num of permutations computed at once in one array.
+    auto_print : bool.
+        Whether to print the ans before returning it or not.
+
+    Returns
+    -------
+    ans : a dict.
+        PK1, PK2, their difference PKD, the permuted differences PKDb, the num of permutations
+        done n_perm, whether they were enumerated (exact) or stopped early (stopped), and the
+        two-sided p value P with its comment.
+
+    Notes
+    -----
+    Under the null hypothesis the two indicators of a case are exchangeable, so each permutation
+    swaps them for a random half of the cases. The indicators are swapped as their average ranks,
+    which leaves both pk values unchanged but makes indicators of different scales exchangeable.
+    y is categorized once and all the permutations of a batch are counted into one stack of matrix.
+
+    """
+
+    assert n_perm >= 1 and batch_size >= 1, "n_perm and batch_size should be positive."
+    x1, y, _ = _check_xy(x1_in, y_in)
+    x2, y, _ = _check_xy(x2_in, y_in)
+
+    # check y and set the category once.
+    fy = _factorize_y(y)
+    n_case = len(y)
+
+    # swap the indicators as their ranks, coded on the levels shared by both.
+    levels, codes = np.unique(np.concatenate([rankdata(x1), rankdata(x2)]), return_inverse=True)
+    codes = codes.reshape(2, n_case)
+    cols = len(levels)
+    batch_size = max(1, min(batch_size, _CHUNK_ITEMS // (fy["rows"] * cols)))
+
+    PK1, PK2 = _swapped_pks(fy, codes, cols, np.zeros((1, n_case), dtype=bool))
+    PKD = PK1[0] - PK2[0]
+
+    exact = 2 ** n_case <= n_perm
+    rng = np.random.default_rng(seed)
+    PKDb = []
+    done = 0
+    hits = 0
+    stopped = False
+    total = 2 ** n_case if exact else n_perm
+    while done < total:
+        size = min(batch_size, total - done)
+        if exact:
+            masks = ((np.arange(done, done + size)[:, None] >> np.arange(n_case)[None, :]) & 1).astype(bool)
+        else:
+            masks = rng.random((size, n_case)) < 0.5
+        P1, P2 = _swapped_pks(fy, codes, cols, masks)
+        D = P1 - P2
+        PKDb.append(D)
+        hits += int(np.sum(np.abs(D) >= abs(PKD) - 1e-12))
+        done += size
+        if early_stop and not exact and done < total:
+            low = beta.ppf(0.005, hits, done - hits + 1) if hits > 0 else 0.0
+            high = beta.ppf(0.995, hits + 1, done - hits) if hits < done else 1.0
+            if low > alpha or high < alpha:
+                stopped = True
+                break
+
+    P = hits / done if exact else (hits + 1) / (done + 1)
+
+    ans = {}
+    ans.update({"type": "pkp"})
+    ans.update({"n_case": n_case})
+    ans.update({"PK1": PK1[0]})
+    ans.update({"PK2": PK2[0]})
+    ans.update({"PKD": PKD})
+    ans.update({"PKDb": np.concatenate(PKDb)})
+    ans.update({"n_perm": done})
+    ans.update({"exact": exact})
+    ans.update({"stopped": stopped})
+    ans.update({"P": P})
+    ans.update({"PJ": judgeP(P)})
+
+    # format and print.
+    if auto_print:
+        print_permutation_compare_pks(ans)
+
+    # return the ans.
+    return ans
+
+
+def print_permutation_compare_pks(result, floatfmt=".3f", tablefmt='simple'):
+    """
+    Pretty display of a paired permutation test of two pk values.
+
+    Parameters
+    ----------
+    result : a dict.
+        Must be the return value of function permutation_compare_pks().
+    floatfmt : string.
+        Decimal number formatting.
+    tablefmt : string.
+        Table format (e.g. 'simple', 'plain', 'html', 'latex', 'grid', 'rst').
+        For a full list of available formats, please refer to
+        https://pypi.org/project/tabulate/
+
+    Returns
+    -------
+    Nothing will be returned.
+
+    Notes
+    -----
+    To be added.
+
+    """
+
+    if isinstance(result, dict) and result.get("type", "unkonwn") == "pkp":
+        df = pd.DataFrame({"PK1": result.get("PK1"),
+                           'PK2': result.get("PK2"),
+                           'PKD': result.get("PKD"),
+                           'Permutations': result.get("n_perm"),
+                           'Exact': result.get("exact"),
+                           'P value': result.get("P"),
+                           "Comment": result.get("PJ")},
+                          index=[0])
+        print('==========================\nPKs permutation comparison\n==========================\n')
+        print_table(df, floatfmt, tablefmt)
+
+
+def _swapped_pks(fy, codes, cols, masks):
+    """
+    The pk values of both indicators after swapping them on the cases where masks is True.
+    """
+
+    size = len(masks)
+    rows = fy["rows"]
+    base = (np.arange(size)[:, None] * rows + fy["Ry"][None, :]) * cols
+    c1 = np.where(masks, codes[1][None, :], codes[0][None, :])
+    c2 = np.where(masks, codes[0][None, :], codes[1][None, :])
+    A1 = np.bincount((base + c1).ravel(), minlength=size * rows * cols).reshape(size, rows, cols)
+    A2 = np.bincount((base + c2).ravel(), minlength=size * rows * cols).reshape(size, rows, cols)
+    return _pk_of_tables(A1), _pk_of_tables(A2)
+
+
+def _bootstrap_chunk(cells, n_case, size, stream):
+    """
+    The pk values of a chunk of multinomial resamples of the non-zero cells.
+    """
+
+    rows, cols, cell_i, cell_j, cell_a = cells
+    rng = np.random.default_rng(stream)
+    counts = rng.multinomial(n_case, cell_a / n_case, size=size)
+    A = np.zeros((size, rows, cols), dtype=np.int64)
+    A[:, cell_i, cell_j] = counts
+    return _pk_of_tables(A)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   service.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import os
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pk4adi.pk import calculate_pk, _check_array, _factorize_y, _pk_ans, _pandas
+from pk4adi.pkc import compare_pks
+from pk4adi.batch import _BATCH_ENGINES
+from pk4adi.cache import fingerprint
+
+__all__ = ["calculate_pk_async", "compare_pks_async", "PKBatcher"]
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+async def calculate_pk_async(x_in, y_in, auto_print = False, method = "numpy", keep_matrices = True, validate = True, executor = None):
+    """
+    The same as calculate_pk(), run in an executor so that the event loop is not blocked.
+
+    Parameters
+    ----------
+    x_in, y_in, method, keep_matrices, validate :
+        See calculate_pk().
+    auto_print : bool, default value is False.
+        Whether to print the ans before returning it or not.
+    executor : a concurrent.futures.Executor or None, default value is None.
+        The executor running calculate_pk(), None for a shared thread pool with one thread per cpu.
+
+    Returns
+    -------
+    ans : a PKResult.
+        The return value of calculate_pk().
+
+    """
+
+    func = functools.partial(calculate_pk, x_in, y_in, auto_print=auto_print, method=method,
+                             keep_matrices=keep_matrices, validate=validate)
+    return await asyncio.get_running_loop().run_in_executor(executor or _default_executor(), func)
+
+
+async def compare_pks_async(pk1, pk2, auto_print = False, legacy = False, executor = None):
+    """
+    The same as compare_pks(), run in an executor so that the event loop is not blocked.
+
+    Parameters
+    ----------
+    pk1, pk2, legacy :
+        See compare_pks().
+    auto_print : bool, default value is False.
+        Whether to print the ans before returning it or not.
+    executor : a concurrent.futures.Executor or None, default value is None.
+        The executor running compare_pks(), None for a shared thread pool with one thread per cpu.
+
+    Returns
+    -------
+    ans : a dict.
+        The return value of compare_pks().
+
+    """
+
+    func = functools.partial(compare_pks, pk1, pk2, auto_print=auto_print, legacy=legacy)
+    return await asyncio.get_running_loop().run_in_executor(executor or _default_executor(), func)
+
+
+class PKBatcher(object):
+    """
+    Group the concurrent calculate_pk() requests sharing the same state y into batches.
+
+    The requests waiting at most max_delay seconds (or until max_batch of them are waiting) form a batch.
+    Within a batch, the requests with the same y are computed together, checking and categorizing
+    y only once as calculate_pk_batch() does, and the groups run in the executor.
+    At most max_pending requests could wait, further calls wait for a free place (backpressure).
+
+    Parameters
+    ----------
+    max_batch : int, default value is 64.
+        The max num of requests in a batch.
+    max_delay : float, default value is 0.002.
+        The max seconds the first request of a batch waits for the others.
+    max_pending : int, default value is 1024.
+        The max num of requests waiting for a batch.
+    executor : a concurrent.futures.Executor or None, default value is None.
+        The executor running the groups, None for a shared thread pool with one thread per cpu.
+    method : string, default value is "numpy".
+        The engine used, "numpy" or "sparse" (see calculate_pk()).
+    keep_matrices : bool, default value is False.
+        Whether to save the rows * cols matrix in the results or not.
+
+    Examples
+    --------
+    async def client(batcher, xs, y):
+        return await asyncio.gather(*[batcher.calculate_pk(x, y) for x in xs])
+
+    async def main(xs, y):
+        async with PKBatcher(max_batch=32) as batcher:
+            answers = await client(batcher, xs, y)
+            print(batcher.stats())
+
+    """
+
+    def __init__(self, max_batch = 64, max_delay = 0.002, max_pending = 1024, executor = None, method = "numpy", keep_matrices = False):
+        assert max_batch >= 1 and max_pending >= 1, "max_batch and max_pending should be at least 1."
+        assert max_delay >= 0, "max_delay should not be negative."
+        assert method in _BATCH_ENGINES, "method should be one of %s." % ", ".join(_BATCH_ENGINES)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.executor = executor
+        self.method = method
+        self.keep_matrices = keep_matrices
+        self._queue = None
+        self._worker = None
+        self._latencies = deque(maxlen=10000)
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "batches": 0, "groups": 0}
+        self._started = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    def start(self):
+        """
+        Start the worker forming the batches, in the running event loop.
+        """
+
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """
+        Wait for the pending requests, then stop the worker.
+        """
+
+        if self._worker is not None:
+            await self._queue.join()
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def calculate_pk(self, x_in, y_in, key = None):
+        """
+        Queue a calculate_pk(x_in, y_in) request and wait for its result.
+
+        Parameters
+        ----------
+        x_in, y_in :
+            See calculate_pk().
+        key : a hashable value or None, default value is None.
+            The identity of y_in, the requests with the same key are computed together.
+            None for a content hash of y_in.
+
+        Returns
+        -------
+        ans : a PKResult.
+            The same as the return value of calculate_pk(x_in, y_in, auto_print=False).
+
+        """
+
+        self.start()
+        if key is None:
+            key = fingerprint(_check_array(y_in, "y", False))
+        future = asyncio.get_running_loop().create_future()
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._counts["submitted"] += 1
+        await self._queue.put((key, x_in, y_in, future, time.perf_counter()))
+        return await future
+
+    def stats(self):
+        """
+        The counters of the batcher.
+
+        Returns
+        -------
+        stats : a dict.
+            submitted, completed and failed requests, batches and groups (of the same y) done,
+            pending requests, mean_batch (requests per batch), the latency in seconds from the
+            submission to the result (mean, p50, p95 and max of the last 10000 requests) and
+            throughput, the completed requests per second since the first one was submitted.
+
+        """
+
+        stats = dict(self._counts)
+        stats["pending"] = self._queue.qsize() if self._queue is not None else 0
+        done = stats["completed"] + stats["failed"]
+        stats["mean_batch"] = done / stats["batches"] if stats["batches"] else np.nan
+        latencies = np.array(self._latencies)
+        if len(latencies):
+            stats.update({"latency_mean": float(latencies.mean()), "latency_p50": float(np.percentile(latencies, 50)),
+                          "latency_p95": float(np.percentile(latencies, 95)), "latency_max": float(latencies.max())})
+        else:
+            stats.update({"latency_mean": np.nan, "latency_p50": np.nan, "latency_p95": np.nan, "latency_max": np.nan})
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0
+        stats["throughput"] = stats["completed"] / elapsed if elapsed > 0 else np.nan
+        return stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self._queue.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), max(timeout, 0)))
+                except asyncio.TimeoutError:
+                    break
+
+            # group the requests by y, then compute the groups in the executor.
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0], []).append(item)
+            executor = self.executor or _default_executor()
+            tasks = [loop.run_in_executor(executor, _score_group, group[0][2], [item[1] for item in group],
+                                          self.method, self.keep_matrices) for group in groups.values()]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            now = time.perf_counter()
+            for group, answers in zip(groups.values(), results):
+                for k, item in enumerate(group):
+                    answer = answers if isinstance(answers, BaseException) else answers[k]
+                    future = item[3]
+                    if not future.done():
+                        if isinstance(answer, BaseException):
+                            future.set_exception(answer)
+                            self._counts["failed"] += 1
+                        else:
+                            future.set_result(answer)
+                            self._counts["completed"] += 1
+                    self._latencies.append(now - item[4])
+            self._counts["batches"] += 1
+            self._counts["groups"] += len(groups)
+            for _ in batch:
+                self._queue.task_done()
+
+
+def _score_group(y_in, xs, method, keep_matrices):
+    """
+    calculate_pk() of each x against the same y, checking and categorizing y only once.
+
+    Returns
+    -------
+    answers : a list.
+        The PKResult of each x, or the exception raised by it.
+
+    """
+
+    y = _check_array(y_in, "y")
+    assert len(y) >= 2, "x and y should contain at least two cases."
+    fy = _factorize_y(y)
+    answers = []
+    for x_in in xs:
+        try:
+            pd = _pandas()
+            index = x_in.index if pd is not None and isinstance(x_in, pd.Series) else None
+            x = _check_array(x_in, "x")
+            assert len(x) == len(y), "x and y should contain the same cases."
+            answers.append(_pk_ans(_BATCH_ENGINES[method](fy, x), index, method, keep_matrices))
+        except Exception as e:
+            answers.append(e)
+    return answers
+
+
+def _default_executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="pk4adi")
+    return _EXECUTOR
@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+@File    :   stream.py
+@Contact :   Jiang Feng(silencejiang@zju.edu.cn)
+@License :   (C)Copyright 2004-2020, Zhejiang University
+"""
+
+import bisect
+import math
+import numpy as np
+import pandas as pd
+from pk4adi.pk import _cell_e, _check_array, _exact_sum, _jackknife_cells, _jackknife_sums
+
+__all__ = ["IncrementalPK", "rolling_pk"]
+
+
+class IncrementalPK(object):
+    """
+    Streaming accumulator of the pk value, updated one (indicator, state) case at a time.
+    Cases could be removed as well, which makes sliding windows possible.
+
+    The accumulator keeps the count matrix A over the x and y levels seen so far, and for
+    each row (y level) a segment tree over the x levels holding, for every cell, the case
+    count and E = C - D, the concordant minus the discordant count of a case located in it.
+    Adding a case changes E of the other cells by +1 or -1 on each side of its x level,
+    which are range updates of the trees, so Qc, Qd, Qtx, Term1 and the per-row sums behind
+    SE0 and SE1 are all maintained in O(rows * log(cols)) per case.
+
+    A case with a new x or y level rebuilds the trees from A in O(rows * cols). Pass the
+    levels in advance (such as range(101) for BIS) to keep every update logarithmic.
+
+    Parameters
+    ----------
+    x_levels : a list or None.
+        The possible values of the indicator, if known in advance.
+    y_levels : a list or None.
+        The possible values of the state, if known in advance.
+
+    """
+
+    def __init__(self, x_levels = None, y_levels = None):
+        self.x_levels = sorted(set(np.asarray(x_levels).tolist())) if x_levels is not None else []
+        self.y_levels = sorted(set(np.asarray(y_levels).tolist())) if y_levels is not None else []
+        self.A = np.zeros((len(self.y_levels), len(self.x_levels)), dtype=np.int64)
+        self._rebuild()
+
+    @property
+    def n_case(self):
+        return self.n
+
+    def update(self, x, y):
+        """
+        Add one case.
+
+        Parameters
+        ----------
+        x : int or float.
+            Indicator.
+        y : int or float.
+            State.
+
+        """
+
+        x, y = _check_case(x, y)
+        self._add(x, y, 1)
+
+    def remove(self, x, y):
+        """
+        Remove one case added before.
+
+        Parameters
+        ----------
+        x : int or float.
+            Indicator.
+        y : int or float.
+            State.
+
+        """
+
+        x, y = _check_case(x, y)
+        self._add(x, y, -1)
+
+    def update_many(self, xs, ys):
+        """
+        Add many cases, the result is the same as calling update() on each of them.
+
+        Large batches are added to A at once, followed by one rebuild.
+
+        Parameters
+        ----------
+        xs : a list, pandas.Series or 1-D numpy.ndarray.
+            Indicator.
+        ys : a list, pandas.Series or 1-D numpy.ndarray.
+            State.
+
+        """
+
+        xs, ys = _check_cases(xs, ys)
+        if self._small(len(xs)):
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self._add(x, y, 1)
+            return
+
+        # merge the new levels, then count the new cases into A and rebuild.
+        x_levels = np.union1d(self.x_levels, xs) if self.x_levels else np.unique(xs)
+        y_levels = np.union1d(self.y_levels, ys) if self.y_levels else np.unique(ys)
+        A = np.zeros((len(y_levels), len(x_levels)), dtype=np.int64)
+        A[np.ix_(np.searchsorted(y_levels, self.y_levels), np.searchsorted(x_levels, self.x_levels))] = self.A
+        np.add.at(A, (np.searchsorted(y_levels, ys), np.searchsorted(x_levels, xs)), 1)
+        self.x_levels = x_levels.tolist()
+        self.y_levels = y_levels.tolist()
+        self.A = A
+        self._rebuild()
+
+    def remove_many(self, xs, ys):
+        """
+        Remove many cases added before, the result is the same as calling remove() on each of them.
+
+        Large batches are removed from A at once, followed by one rebuild.
+
+        Parameters
+        ----------
+        xs : a list, pandas.Series or 1-D numpy.ndarray.
+            Indicator.
+        ys : a list, pandas.Series or 1-D numpy.ndarray.
+            State.
+
+        """
+
+        xs, ys = _check_cases(xs, ys)
+        if self._small(len(xs)):
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self._add(x, y, -1)
+            return
+
+        i = np.searchsorted(self.y_levels, ys)
+        j = np.searchsorted(self.x_levels, xs)
+        assert (i < len(self.y_levels)).all() and (j < len(self.x_levels)).all(), "Some cases have not been added."
+        assert (np.asarray(self.y_levels)[i] == ys).all() and (np.asarray(self.x_levels)[j] == xs).all(), "Some cases have not been added."
+        A = self.A.copy()
+        np.add.at(A, (i, j), -1)
+        assert (A >= 0).all(), "Some cases have not been added."
+        self.A = A
+        self._rebuild()
+
+    def result(self, jackknife = False):
+        """
+        Report the pk value and the standard errors of all the cases added so far.
+
+        Parameters
+        ----------
+        jackknife : bool, default value is False.
+            Whether to do the jackknife too or not, which takes O(rows * cols).
+
+        Returns
+        -------
+        ans : a dict.
+            n_case, n, Qc, Qd, Qtx, Qcdt, dyx, PK, Term1, Term2, Term3, SE1 and SE0,
+            the same as the variables of the same name returned by calculate_pk().
+            With jackknife, jack_ok, SPKm, SSPKm, PKj and SEj as well.
+            The values are nan until at least two distinct states have been added.
+
+        """
+
+        n = self.n
+        Qc = self.Qc
+        Qd = self.Qd
+        Qtx = self.Qtx
+        Qcdt = Qc + Qd + Qtx
+        ans = {"n_case": n, "n": n, "Qc": Qc, "Qd": Qd, "Qtx": Qtx, "Qcdt": Qcdt,
+               "dyx": np.nan, "PK": np.nan, "Term1": self.Term1, "Term2": np.nan, "Term3": np.nan,
+               "SE1": np.nan, "SE0": np.nan}
+        if jackknife:
+            ans.update({"jack_ok": False, "SPKm": np.nan, "SSPKm": np.nan, "PKj": np.nan, "SEj": np.nan})
+        if Qcdt == 0:
+            return ans
+
+        dyx = (Qc - Qd) / Qcdt
+        Term1 = self.Term1
+        Term2 = 0
+        Term3 = 0
+        for ni, Ei in zip(self.ni, self.Ei):
+            Term2 = Term2 + (n - ni) * Ei
+            Term3 = Term3 + ni * (n - ni) * (n - ni)
+        Term2 = -2 * dyx * Term2
+        Term3 = dyx * dyx * Term3
+        ans.update({"dyx": dyx, "PK": (dyx + 1) / 2, "Term2": Term2, "Term3": Term3,
+                    "SE1": math.sqrt(max(Term1 + Term2 + Term3, 0)) / Qcdt,
+                    "SE0": math.sqrt(max(Term1 - (Qc - Qd) * (Qc - Qd) / n, 0)) / Qcdt})
+
+        # do jackknife from the cell values of C, D and T.
+        if jackknife:
+            present = np.array(self.ni) > 0
+            jack_ok = bool(present.sum() > 2 or min(np.array(self.ni)[present]) >= 2)
+            ans.update({"jack_ok": jack_ok})
+            if jack_ok:
+                A = self.A
+                E = _cell_e(A)
+                both = n - np.array(self.ni)[:, None] - np.array(self.nj)[None, :] + A
+                index = np.nonzero(A)
+                cell_a = A[index]
+                cell_c = (both + E)[index] // 2
+                cell_d = (both - E)[index] // 2
+                cell_t = np.array(self.nj)[index[1]] - cell_a
+                cell_pkm = _jackknife_cells(Qc, Qd, Qtx, cell_c, cell_d, cell_t)
+                SPKm, SSPKm, PKj, SEj = _jackknife_sums(n, ans["PK"], cell_a, cell_pkm)
+                ans.update({"SPKm": SPKm, "SSPKm": SSPKm, "PKj": PKj, "SEj": SEj})
+        return ans
+
+    def _small(self, size):
+        """
+        Whether a batch of cases is small enough to be added or removed one by one.
+        """
+
+        return size * max(math.log2(max(self.A.size, 2)), 1) < self.A.size
+
+    def _add(self, x, y, sign):
+        """
+        Add (sign = 1) or remove (sign = -1) one case.
+        """
+
+        i = bisect.bisect_left(self.y_levels, y)
+        j = bisect.bisect_left(self.x_levels, x)
+        if i == len(self.y_levels) or self.y_levels[i] != y or j == len(self.x_levels) or self.x_levels[j] != x:
+            assert sign > 0, "The case (%s, %s) has not been added." % (x, y)
+            self._insert_level(x, y)
+            i = bisect.bisect_left(self.y_levels, y)
+            j = bisect.bisect_left(self.x_levels, x)
+        assert sign > 0 or self.A[i, j] > 0, "The case (%s, %s) has not been added." % (x, y)
+
+        cols = len(self.x_levels)
+        if sign < 0:
+            self._move(i, j, sign)
+
+        # the cases differing from the case in both x and y, or only in y.
+        nj = self.nj[j]
+        aij = int(self.A[i, j])
+        both = self.n - self.ni[i] - nj + aij
+        tied = nj - aij
+
+        # W = sum of s * E over the other cases, where s = sign(x - xp) * sign(y - yp).
+        W = 0
+        for r, tree in enumerate(self.trees):
+            if r == i:
+                continue
+            lower = tree.query(0, j)
+            upper = tree.query(j + 1, cols)
+            W += (upper - lower) if r > i else (lower - upper)
+        Ep = self.trees[i].point(j)
+
+        self.Term1 += sign * (2 * W + both + Ep * Ep)
+        self.Qcd_sum += sign * 2 * both
+        self.Qtx += sign * 2 * tied
+        self.QcQd += sign * 2 * Ep
+        self.Qc = (self.Qcd_sum + self.QcQd) // 2
+        self.Qd = (self.Qcd_sum - self.QcQd) // 2
+
+        if sign > 0:
+            self._move(i, j, sign)
+
+    def _move(self, i, j, sign):
+        """
+        Update the counts, the trees and the per-row sums for a case added to or removed from cell (i, j).
+        """
+
+        cols = len(self.x_levels)
+        for r, tree in enumerate(self.trees):
+            if r == i:
+                continue
+            delta = sign if r > i else -sign
+            before = tree.total()
+            tree.add(j + 1, cols, delta)
+            tree.add(0, j, -delta)
+            self.Ei[r] += tree.total() - before
+        before = self.trees[i].total()
+        self.trees[i].count(j, sign)
+        self.Ei[i] += self.trees[i].total() - before
+        self.A[i, j] += sign
+        self.ni[i] += sign
+        self.nj[j] += sign
+        self.n += sign
+
+    def _insert_level(self, x, y):
+        if y not in self.y_levels:
+            i = bisect.bisect_left(self.y_levels, y)
+            self.y_levels.insert(i, y)
+            self.A = np.insert(self.A, i, 0, axis=0)
+        if x not in self.x_levels:
+            j = bisect.bisect_left(self.x_levels, x)
+            self.x_levels.insert(j, x)
+            self.A = np.insert(self.A, j, 0, axis=1)
+        self._rebuild()
+
+    def _rebuild(self):
+        """
+        Recompute all the sums and the trees from the count matrix A.
+        """
+
+        A = self.A
+        ni = A.sum(axis=1)
+        nj = A.sum(axis=0)
+        n = int(A.sum())
+
+        E = _cell_e(A)
+
+        self.n = n
+        self.ni = ni.tolist()
+        self.nj = nj.tolist()
+        self.Ei = [int(v) for v in (A * E).sum(axis=1)]
+        self.QcQd = int((A * E).sum())
+        self.Qcd_sum = int((A * (n - ni[:, None] - nj[None, :] + A)).sum())
+        self.Qtx = int((A * (nj[None, :] - A)).sum())
+        self.Qc = (self.Qcd_sum + self.QcQd) // 2
+        self.Qd = (self.Qcd_sum - self.QcQd) // 2
+        self.Term1 = _exact_sum(A, E, E)
+        self.trees = [_CellTree(A[r], E[r]) for r in range(len(A))]
+
+
+def rolling_pk(x_in, y_in, window, step = 1, jackknife = False):
+    """
+    Compute the pk values in sliding windows over a long recording.
+        Each step removes the cases leaving the window and adds the cases entering it,
+        so a step costs O(step * rows * log(cols)) instead of a new calculate_pk().
+
+    Parameters
+    ----------
+    x_in : a list, pandas.Series or 1-D numpy.ndarray.
+        Indicator.
+    y_in : a list, pandas.Series or 1-D numpy.ndarray.
+        State.
+    window : int.
+        The case num of each window, e.g. 600 for 10 minutes sampled at 1 Hz.
+    step : int, default value is 1.
+        The case num between the starts of two windows, e.g. 10 for 10 seconds at 1 Hz.
+    jackknife : bool, default value is False.
+        Whether to do the jackknife in each window too or not, which takes O(rows * cols) per window.
+
+    Returns
+    -------
+    table : a pandas.DataFrame.
+        One row per window with the columns start, end (the positions of the first case
+        and the one after the last case), n_case, PK, SE0 and SE1, and jack_ok, PKj and SEj
+        with jackknife. PK and the SEs are nan for a window with only one distinct state.
+
+    Notes
+    -----
+    To be added.
+
+    """
+
+    x, y = _check_cases(x_in, y_in)
+    n_case = len(x)
+    assert isinstance(window, (int, np.integer)) and 2 <= window <= n_case, "window should be an int in [2, len(x)]."
+    assert isinstance(step, (int, np.integer)) and step >= 1, "step should be a positive int."
+
+    # all the levels are known, so no window needs a rebuild.
+    acc = IncrementalPK(x_levels=x, y_levels=y)
+    acc.update_many(x[:window], y[:window])
+
+    keys = ["n_case", "PK", "SE0", "SE1"] + (["jack_ok", "PKj", "SEj"] if jackknife else [])
+    records = []
+    start = 0
+    while True:
+        ans = acc.result(jackknife)
+        records.append([start, start + window] + [ans[key] for key in keys])
+        if start + step + window > n_case:
+            break
+        if step >= window:
+            acc = IncrementalPK(x_levels=acc.x_levels, y_levels=acc.y_levels)
+            acc.update_many(x[start + step:start + step + window], y[start + step:start + step + window])
+        else:
+            acc.remove_many(x[start:start + step], y[start:start + step])
+            acc.update_many(x[start + window:start + window + step], y[start + window:start + window + step])
+        start += step
+
+    return pd.DataFrame(records, columns=["start", "end"] + keys)
+
+
+def _check_cases(xs, ys):
+    """
+    Convert the cases to 1-D numpy.ndarray and check them.
+    """
+
+    xs = _check_array(xs, "x")
+    ys = _check_array(ys, "y")
+    assert len(xs) == len(ys), "x and y should contain the same cases."
+    return xs, ys
+
+
+def _check_case(x, y):
+    """
+    Check one case as _check_cases() does, and convert it to Python numbers.
+    """
+
+    xs, ys = _check_cases([x], [y])
+    return xs[0].item(), ys[0].item()
+
+
+class _CellTree(object):
+    """
+    Segment tree over the x levels of one row, holding the count a and the value E of each cell.
+
+    E is only stored as tags which are never pushed down, so the E of a cell is the sum of
+    the tags on the path from the root to its leaf, and the sum of a * E of a node only
+    includes the tags at or below it.
+
+    """
+
+    def __init__(self, counts, values):
+        size = 1
+        while size < max(len(counts), 1):
+            size *= 2
+        self.size = size
+        cnt = np.zeros(2 * size, dtype=np.int64)
+        tag = np.zeros(2 * size, dtype=np.int64)
+        sae = np.zeros(2 * size, dtype=np.int64)
+        cnt[size:size + len(counts)] = counts
+        tag[size:size + len(values)] = values
+        sae[size:size + len(counts)] = np.asarray(counts) * np.asarray(values)
+        for node in range(size - 1, 0, -1):
+            cnt[node] = cnt[2 * node] + cnt[2 * node + 1]
+            sae[node] = sae[2 * node] + sae[2 * node + 1]
+        self.cnt = [int(v) for v in cnt]
+        self.tag = [int(v) for v in tag]
+        self.sae = [int(v) for v in sae]
+
+    def total(self):
+        return self.sae[1]
+
+    def add(self, lo, hi, delta, node = 1, nlo = 0, nhi = None):
+        """
+        Add delta to E of the cells lo, ..., hi - 1.
+        """
+
+        if nhi is None:
+            nhi = self.size
+        if hi <= nlo or nhi <= lo or lo >= hi:
+            return
+        if lo <= nlo and nhi <= hi:
+            self.tag[node] += delta
+            self.sae[node] += delta * self.cnt[node]
+            return
+        mid = (nlo + nhi) // 2
+        self.add(lo, hi, delta, 2 * node, nlo, mid)
+        self.add(lo, hi, delta, 2 * node + 1, mid, nhi)
+        self.sae[node] = self.sae[2 * node] + self.sae[2 * node + 1] + self.tag[node] * self.cnt[node]
+
+    def query(self, lo, hi, node = 1, nlo = 0, nhi = None):
+        """
+        Sum of a * E over the cells lo, ..., hi - 1.
+        """
+
+        return self._query(lo, hi, node, nlo, self.size if nhi is None else nhi)[1]
+
+    def _query(self, lo, hi, node, nlo, nhi):
+        if hi <= nlo or nhi <= lo or lo >= hi:
+            return 0, 0
+        if lo <= nlo and nhi <= hi:
+            return self.cnt[node], self.sae[node]
+        mid = (nlo + nhi) // 2
+        c1, s1 = self._query(lo, hi, 2 * node, nlo, mid)
+        c2, s2 = self._query(lo, hi, 2 * node + 1, mid, nhi)
+        return c1 + c2, s1 + s2 + self.tag[node] * (c1 + c2)
+
+    def point(self, pos):
+        """
+        E of the cell pos.
+        """
+
+        node = pos + self.size
+        value = 0
+        while node:
+            value += self.tag[node]
+            node //= 2
+        return value
+
+    def count(self, pos, delta):
+        """
+        Add delta to the count of the cell pos.
+        """
+
+        path = []
+        node = pos + self.size
+        while node:
+            path.append(node)
+            node //= 2
+        below = 0
+        for node in path:
+            below += self.tag[node]
+            self.cnt[node] += delta
+            self.sae[node] += delta * below
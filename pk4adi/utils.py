@@ -7,7 +7,6 @@
 """
 
 
-from tabulate import tabulate
 
 __all__ = ["print_table"]
 
@@ -36,6 +35,8 @@ def print_table(df, floatfmt=".3f", tablefmt='simple'):
 
     """
 
+    from tabulate import tabulate
+
     print(tabulate(df, headers="keys", showindex=False, floatfmt=floatfmt,
                     tablefmt=tablefmt))
     print("\n")
\ No newline at end of file
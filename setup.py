@@ -51,6 +51,9 @@ setup(
     python_requires=">=3.8",
     install_requires=get_install_requires(),
     packages=find_packages(),
+    entry_points={
+        'console_scripts': ['pk4adi = pk4adi.cli:main'],
+    },
     license='MIT License',
     classifiers=[
         'License :: OSI Approved :: MIT License',